@@ -0,0 +1,255 @@
+# Headless benchmark of the data paths of the three visualisations (the
+# names_lib queries and names_charts charts the apps call), on a synthetic
+# dpt2020.csv, timed by stage: ingest, load, aggregate and index once, then
+# for each period filter (index lookups), top_k, aggregate, chart and map
+#
+# python3 benchmark.py --scales 1 10 --output benchmark.json
+
+import argparse
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+
+# Rows of the synthetic csv at scale 1 (the real dpt2020.csv has ~3.7M)
+BASE_ROWS = 100_000
+
+# Periods and names replayed as slider moves and name selections
+PERIODS = [(1900, 2020), (1990, 2000), (1950, 1980), (2010, 2020)]
+SELECTED_NAMES = 5
+
+SOURCE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+# dpt2020-shaped rows: unique (sexe, preusuel, annais, dpt), a few skewed
+# popular names, rare names and unknown years/departments like INSEE's
+def synthetic_names(rows, departments, seed=0):
+    rng = np.random.default_rng(seed)
+    n_names = max(200, rows // 100)
+    names = np.array([f'PRENOM{i}' for i in range(n_names)])
+    popularity = 1 / np.sqrt(np.arange(1, n_names + 1))
+
+    draws = int(rows * 1.3)
+    frame = pd.DataFrame({
+        'sexe': rng.integers(1, 3, draws),
+        'preusuel': names[rng.choice(
+            n_names, draws, p=popularity / popularity.sum())],
+        'annais': rng.integers(1900, 2021, draws).astype(str),
+        'dpt': np.asarray(departments)[
+            rng.integers(0, len(departments), draws)],
+        'nombre': np.minimum(rng.zipf(1.8, draws) + 2, 5000),
+    })
+    frame = frame.drop_duplicates(['sexe', 'preusuel', 'annais', 'dpt'])
+    frame = frame.head(rows).reset_index(drop=True)
+
+    rare = rng.random(len(frame)) < 0.01
+    frame.loc[rare, 'preusuel'] = '_PRENOMS_RARES'
+    unknown = rng.random(len(frame)) < 0.005
+    frame.loc[unknown, ['annais', 'dpt']] = ['XXXX', 'XX']
+    return frame.drop_duplicates(['sexe', 'preusuel', 'annais', 'dpt'])
+
+
+class Stages:
+    # Wall time and traced peak memory of each stage, summed over repeats
+    # (tracemalloc slows the stages down, compare runs with each other)
+
+    def __init__(self):
+        self.results = {}
+
+    @contextmanager
+    def stage(self, name):
+        tracemalloc.reset_peak()
+        start = time.perf_counter()
+        yield
+        seconds = time.perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1] / 1024 ** 2
+        result = self.results.setdefault(name, {'seconds': 0, 'peak_mb': 0})
+        result['seconds'] += seconds
+        result['peak_mb'] = max(result['peak_mb'], peak)
+
+
+def run_scale(scale, base_rows):
+    # Imported here: the data modules use paths relative to the working
+    # directory, which is the benchmark directory at this point
+    from names_cache import (dataset_store, get_cube, get_name_index,
+                             get_prefix_sums, get_sex_shares, get_trends,
+                             get_yearly_ranks, result_cache)
+    from names_charts import (enable_chart_data, epicene_drift_chart,
+                              popularity_chart, presence_chart,
+                              presence_scatter_chart, top_20_chart,
+                              top_region_chart, trend_chart)
+    from names_cubes import CUBE_LEVELS, build_cubes
+    from names_data import build_cache, load_regions, read_cache
+    from names_geo import load_geometries
+    from names_lib import (density_areas, epicene_names, name_totals,
+                           period_regions, presence_bars, presence_scatter,
+                           rank_ends, rank_series, top_each_year, top_names,
+                           trending_names)
+    from names_map import density_colormap, density_map
+
+    # The datasets and results of the previous scale are not reused
+    dataset_store().invalidate()
+    result_cache().clear()
+
+    enable_chart_data()
+    stages = Stages()
+    start = time.perf_counter()
+
+    with stages.stage('generate'):
+        names = synthetic_names(
+            base_rows * scale, load_regions()['num_dep'].to_numpy())
+        names.to_csv(os.path.join('data', 'dpt2020.csv'), sep=';',
+                     index=False)
+        rows = len(names)
+        del names
+
+    with stages.stage('ingest'):
+        build_cache()
+    with stages.stage('aggregate'):
+        build_cubes()
+    # Cold load of the cache and of the cubes the apps keep in memory
+    with stages.stage('load'):
+        read_cache()
+        for level in CUBE_LEVELS:
+            get_cube(level)
+    # Indexes over all the years, built once per process (the region and
+    # department ones are built per decade by the period queries)
+    with stages.stage('index'):
+        get_prefix_sums()
+        get_yearly_ranks()
+        get_sex_shares()
+        get_trends()
+        name_index = get_name_index()
+    with stages.stage('geometry'):
+        load_geometries('region', 'medium')
+
+    selected = tuple(name_index.search('', limit=SELECTED_NAMES))
+    region = load_regions()['region_name'].iloc[0]
+    for period in PERIODS:
+        # Chart data of the visualisations, as for a slider move. Each stage
+        # reuses the cached results of the previous ones, as the apps do.
+        # Totals of the period from the indexes (per decade for the regions)
+        with stages.stage('filter'):
+            name_totals(period)
+            name_totals(period, region)
+            period_regions(period)
+        with stages.stage('top_k'):
+            top_20_males = top_names(period, 1, 20).assign(gender='Male')
+            top_20_females = top_names(period, 2, 20).assign(gender='Female')
+            top_10_france = pd.concat(
+                [top_names(period, 1, 10), top_names(period, 2, 10)])
+            top_10_region = pd.concat([top_names(period, 1, 10, region),
+                                       top_names(period, 2, 10, region)])
+            top_each_year(period, 20)
+            trending = trending_names(period, 'burst', 20)
+        with stages.stage('aggregate'):
+            rank_data = rank_series(selected, period)
+            rank_data_ends = rank_ends(selected, period)
+            areas = density_areas(selected[0], period, 'region')
+            presence = presence_bars(period, 20)
+            scatter = presence_scatter(period, 20)
+            epicene = epicene_names(period, 20)
+
+        with stages.stage('chart'):
+            charts = [
+                top_20_chart(top_20_males, top_20_females),
+                popularity_chart(rank_data, rank_data_ends),
+                top_region_chart(top_10_france, top_10_region, region),
+                presence_chart(presence),
+                presence_scatter_chart(scatter, period),
+            ]
+            if not trending.empty:
+                charts.append(trend_chart(trending, 'burst'))
+            if not epicene.empty:
+                charts.append(epicene_drift_chart(epicene))
+            for chart in charts:
+                chart.to_dict()
+
+        with stages.stage('map'):
+            density_map(areas, density_colormap(
+                areas['density'])).get_root().render()
+
+    return {
+        'rows': rows,
+        'wall_seconds': time.perf_counter() - start,
+        'peak_traced_mb': max(result['peak_mb']
+                              for result in stages.results.values()),
+        'peak_rss_mb': resource.getrusage(
+            resource.RUSAGE_SELF).ru_maxrss / 1024,
+        'stages': stages.results,
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'], cwd=SOURCE_DIR,
+            stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+# Run each scale in a scratch directory holding a copy of the static data
+# files (and of the geometries if already built)
+def run_benchmark(scales, base_rows=BASE_ROWS):
+    report = {
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'pandas': pd.__version__,
+        'base_rows': base_rows,
+        'periods': PERIODS,
+        'scales': {},
+    }
+    sys.path.insert(0, SOURCE_DIR)
+    cwd = os.getcwd()
+    tracemalloc.start()
+    try:
+        for scale in scales:
+            with tempfile.TemporaryDirectory() as workdir:
+                shutil.copytree(
+                    os.path.join(SOURCE_DIR, 'data'),
+                    os.path.join(workdir, 'data'),
+                    ignore=shutil.ignore_patterns('dpt*', 'nat*', 'cache'))
+                cache = os.path.join(SOURCE_DIR, 'data', 'cache')
+                os.makedirs(os.path.join(workdir, 'data', 'cache'))
+                if os.path.isdir(cache):
+                    for name in os.listdir(cache):
+                        if name.startswith('geo_'):
+                            shutil.copy2(os.path.join(cache, name),
+                                         os.path.join(workdir, 'data',
+                                                      'cache', name))
+                os.chdir(workdir)
+                try:
+                    report['scales'][str(scale)] = run_scale(scale, base_rows)
+                finally:
+                    os.chdir(cwd)
+    finally:
+        tracemalloc.stop()
+    return report
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Benchmark the data paths of the visualisations')
+    parser.add_argument('--scales', type=int, nargs='+', default=[1, 10],
+                        help='sizes of the synthetic csv, in BASE_ROWS')
+    parser.add_argument('--base-rows', type=int, default=BASE_ROWS)
+    parser.add_argument('--output', help='json file (default: stdout)')
+    args = parser.parse_args()
+
+    report = run_benchmark(args.scales, args.base_rows)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
@@ -0,0 +1,201 @@
+# Static export of the charts and maps of the three apps, without a
+# Streamlit server, for a batch of periods, regions and names
+#
+# python3 export.py --periods 1900-2020 1990-2000 --regions Bretagne \
+#     --names MARIE JEAN --formats html png --output exports
+#
+# The charts are saved as html, svg or png (svg and png need the optional
+# vl-convert-python package), the maps as html only.
+
+import argparse
+import functools
+import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+from names_cache import BACKEND
+from names_charts import (CHART_DATA, enable_chart_data, epicene_drift_chart,
+                          popularity_chart, presence_chart,
+                          presence_scatter_chart, sex_share_chart,
+                          top_20_chart, top_region_chart, trend_chart)
+from names_cubes import cubes_are_fresh, update_cubes
+from names_geo import GRANULARITIES, load_geometries
+from names_lib import (density_areas, epicene_names, period_regions,
+                       presence_bars, presence_scatter, rank_ends, rank_series,
+                       sex_share_series, top_names, trending_names,
+                       year_bounds)
+from names_map import density_colormap, density_map
+from names_search import normalize
+from names_trends import TREND_KINDS, load_trends
+
+CHART_FORMATS = ['html', 'svg', 'png']
+
+
+# File name part of a region or names ('Île-de-France' gives
+# 'ILE-DE-FRANCE')
+def slug(text):
+    return re.sub(r'[^A-Z0-9]+', '-', normalize(text)).strip('-')
+
+
+# Figures to export: (kind, period, selection), the selection being a
+# region, a tuple of names or a (name, granularity) pair
+def export_jobs(periods, regions, names):
+    jobs = []
+    for period in periods:
+        jobs += [('top_20', period, None), ('presence', period, None),
+                 ('presence_scatter', period, None), ('epicene', period, None),
+                 ('sex_share', period, None)]
+        jobs += [('trends', period, kind) for kind in TREND_KINDS]
+        if names:
+            jobs.append(('popularity', period, tuple(names)))
+        jobs += [('top_region', period, region) for region in regions]
+        jobs += [('density', period, (name, granularity))
+                 for name in names for granularity in GRANULARITIES]
+    return jobs
+
+
+# Chart or map of a job, None when there is no data to show
+def build_figure(kind, period, selection):
+    if kind == 'top_20':
+        top_20_males = top_names(period, 1, 20).assign(gender='Male')
+        top_20_females = top_names(period, 2, 20).assign(gender='Female')
+        if top_20_males.empty and top_20_females.empty:
+            return None
+        return top_20_chart(top_20_males, top_20_females)
+    if kind == 'popularity':
+        name_rank_data = rank_series(selection, period)
+        if name_rank_data.empty:
+            return None
+        return popularity_chart(name_rank_data, rank_ends(selection, period))
+    if kind == 'top_region':
+        top_names_france = pd.concat(
+            [top_names(period, 1, 10), top_names(period, 2, 10)])
+        top_names_region = pd.concat([top_names(period, 1, 10, selection),
+                                      top_names(period, 2, 10, selection)])
+        return top_region_chart(top_names_france, top_names_region, selection)
+    if kind == 'density':
+        name, granularity = selection
+        areas_geo = density_areas(name, period, granularity)
+        return density_map(areas_geo, density_colormap(areas_geo['density']))
+    if kind == 'presence':
+        return presence_chart(presence_bars(period, 20))
+    if kind == 'presence_scatter':
+        return presence_scatter_chart(presence_scatter(period, 20), period)
+    if kind in ('epicene', 'sex_share'):
+        epicene = epicene_names(period, 20)
+        if epicene.empty:
+            return None
+        if kind == 'epicene':
+            return epicene_drift_chart(epicene)
+        # Male share of the 5 names that moved the most
+        return sex_share_chart(sex_share_series(
+            tuple(epicene['preusuel'][:5]), period))
+    if kind == 'trends':
+        trending = trending_names(period, selection, 20)
+        if trending.empty:
+            return None
+        return trend_chart(trending, selection)
+    raise ValueError(f'Unknown figure: {kind}')
+
+
+def figure_name(kind, period, selection):
+    name = f'{kind}_{period[0]}-{period[1]}'
+    if kind == 'popularity':
+        name += '_' + slug(' '.join(selection))
+    elif kind == 'density':
+        name += f'_{slug(selection[0])}_{selection[1]}'
+    elif selection is not None:
+        name += '_' + slug(selection)
+    return name
+
+
+# Run in the worker processes: save one figure in each format, return the
+# written paths
+def export_figure(job, formats, output):
+    figure = build_figure(*job)
+    if figure is None:
+        return []
+
+    base = os.path.join(output, figure_name(*job))
+    if job[0] == 'density':
+        figure.save(base + '.html')
+        return [base + '.html']
+
+    paths = []
+    for extension in formats:
+        figure.save(f'{base}.{extension}')
+        paths.append(f'{base}.{extension}')
+    return paths
+
+
+def worker_init(policy):
+    enable_chart_data(policy)
+
+
+def parse_period(text):
+    start_year, end_year = text.split('-')
+    return int(start_year), int(end_year)
+
+
+def export(periods, regions, names, formats, output, workers=None,
+           policy=CHART_DATA):
+    os.makedirs(output, exist_ok=True)
+
+    # Build or update the cubes (only the changed years of a new csv), the
+    # trends, the tensor of NAMES_BACKEND=tensor and the map polygons once,
+    # before the workers read them
+    if not cubes_are_fresh():
+        update_cubes()
+    load_trends()
+    if BACKEND == 'tensor':
+        from names_tensor import tensor
+        tensor()
+    for granularity in GRANULARITIES:
+        load_geometries(granularity, 'medium')
+
+    jobs = export_jobs(periods, regions, names)
+    # Jobs of a period go to the same worker, which computes its aggregates
+    # once (names_lib results cache): the jobs are grouped by period, with
+    # as many jobs for each, so a chunk is a period. The periods are spread
+    # over the workers.
+    chunksize = max(1, len(jobs) // max(1, len(periods)))
+    with ProcessPoolExecutor(workers, initializer=worker_init,
+                             initargs=(policy,)) as pool:
+        written = pool.map(functools.partial(
+            export_figure, formats=formats, output=output), jobs,
+            chunksize=chunksize)
+        return [path for paths in written for path in paths]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Export the charts and maps of the visualisations')
+    parser.add_argument('--periods', nargs='+', type=parse_period,
+                        help='periods as start-end (default: all the years)')
+    parser.add_argument('--regions', nargs='*', default=[],
+                        help='regions of the regional top 10s')
+    parser.add_argument('--all-regions', action='store_true',
+                        help='regional top 10s of every region')
+    parser.add_argument('--names', nargs='*', default=[],
+                        help='names of the rank curves and density maps')
+    parser.add_argument('--formats', nargs='+', choices=CHART_FORMATS,
+                        default=['html'])
+    parser.add_argument('--output', default='exports')
+    parser.add_argument('--workers', type=int,
+                        help='processes (default: one per cpu)')
+    args = parser.parse_args()
+
+    periods = args.periods or [year_bounds()]
+    regions = args.regions
+    if args.all_regions:
+        regions = sorted({region for period in periods
+                          for region in period_regions(period)})
+
+    start = time.perf_counter()
+    paths = export(periods, regions, args.names, args.formats, args.output,
+                   args.workers)
+    print(f'{len(paths)} files written to {args.output} in '
+          f'{time.perf_counter() - start:.1f} s')
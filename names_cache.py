@@ -0,0 +1,292 @@
+# Process-wide cache of the cleaned datasets, shared by all the Streamlit
+# sessions of a server
+
+import functools
+import os
+import sys
+import threading
+from collections import OrderedDict
+from importlib import import_module
+
+import streamlit as st
+from streamlit import runtime
+
+from names_cubes import (CUBE_LEVELS, PARTITION_YEARS, cube_partitions,
+                         load_cube, load_summary)
+from names_data import NAMES_CSV, REGIONS_CSV, load_regions
+from names_geo import GEO_SOURCE, load_geometries
+from names_index import AreaShares, PrefixSums, SexShares, YearlyRanks
+from names_search import NameIndex
+from names_trends import load_trends
+
+# Memory budget of the cached datasets, in MB
+MEMORY_CAP_MB = int(os.environ.get('NAMES_CACHE_MB', '2048'))
+
+# Source of the chart data: 'pandas' (cubes and indexes in memory),
+# 'duckdb' (SQL over the cubes on disk, see names_duckdb.py) or 'tensor'
+# (memory-mapped arrays shared by the processes, see names_tensor.py)
+BACKEND = os.environ.get('NAMES_BACKEND', 'pandas')
+
+# Memory budget of the cached chart data, in MB
+RESULTS_CAP_MB = int(os.environ.get('NAMES_RESULTS_MB', '256'))
+
+
+# Identify the version of the source files by their mtime and size
+def source_signature(*paths):
+    return tuple((path, os.stat(path).st_mtime, os.stat(path).st_size)
+                 for path in paths)
+
+
+# Memory used by a cached frame, index or small result (tuple, list)
+def data_size(data):
+    if hasattr(data, 'memory_usage'):
+        return int(data.memory_usage(deep=True).sum())
+    if hasattr(data, 'nbytes'):
+        return int(data.nbytes)
+    if isinstance(data, (tuple, list)):
+        return sys.getsizeof(data) + sum(sys.getsizeof(x) for x in data)
+    return sys.getsizeof(data)
+
+
+class DatasetStore:
+    # One copy of each dataset per process, rebuilt when its sources change
+    # and evicted (least recently used first) above the memory budget
+
+    def __init__(self, memory_cap_mb=MEMORY_CAP_MB):
+        self.memory_cap = memory_cap_mb * 1024 ** 2
+        self.entries = OrderedDict()
+        self.lock = threading.RLock()
+
+    def get(self, key, sources, build):
+        signature = source_signature(*sources)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] == signature:
+                self.entries.move_to_end(key)
+                return entry[1]
+
+            data = build()
+            size = data_size(data)
+            self.entries[key] = (signature, data, size)
+            self.entries.move_to_end(key)
+            self.evict()
+            return data
+
+    def evict(self):
+        # Always keep the dataset that was just built
+        while len(self.entries) > 1 and self.size() > self.memory_cap:
+            self.entries.popitem(last=False)
+
+    def size(self):
+        return sum(entry[2] for entry in self.entries.values())
+
+    def invalidate(self, key=None):
+        with self.lock:
+            if key is None:
+                self.entries.clear()
+            else:
+                self.entries.pop(key, None)
+
+
+class ResultCache:
+    # Chart data already computed, by query and selection (period, region,
+    # name, sex...), evicted least recently used first above the memory
+    # budget. Counts the hits and misses to tune the budget.
+
+    def __init__(self, memory_cap_mb=RESULTS_CAP_MB):
+        self.memory_cap = memory_cap_mb * 1024 ** 2
+        self.entries = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, key, compute):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+
+        # Computed outside of the lock: the queries call each other, and
+        # the other sessions should not wait for it
+        result = compute()
+        size = data_size(result)
+        with self.lock:
+            if key not in self.entries and size <= self.memory_cap:
+                self.entries[key] = (result, size)
+                self.bytes += size
+                self.evict()
+        return result
+
+    def evict(self):
+        while self.bytes > self.memory_cap:
+            self.bytes -= self.entries.popitem(last=False)[1][1]
+
+    def stats(self):
+        with self.lock:
+            return {'hits': self.hits, 'misses': self.misses,
+                    'entries': len(self.entries), 'bytes': self.bytes}
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.bytes = 0
+
+
+@st.cache_resource(show_spinner=False)
+def streamlit_store():
+    return DatasetStore()
+
+
+@st.cache_resource(show_spinner=False)
+def streamlit_results():
+    return ResultCache()
+
+
+HEADLESS_STORE = DatasetStore()
+HEADLESS_RESULTS = ResultCache()
+
+
+# Stores of the Streamlit server, or of the process when run without it
+# (benchmark, exports) where st.cache_resource keeps nothing
+def dataset_store():
+    if runtime.exists():
+        return streamlit_store()
+    return HEADLESS_STORE
+
+
+def result_cache():
+    if runtime.exists():
+        return streamlit_results()
+    return HEADLESS_RESULTS
+
+
+# Cache of the chart data, keyed by the function, its arguments and the
+# version of the sources (names, regions and map polygons), so a selection
+# already seen is not computed again. Frames are copied out as callers may
+# modify them.
+def cached_query(function):
+    @functools.wraps(function)
+    def query(*args, **kwargs):
+        key = (function.__name__,
+               source_signature(NAMES_CSV, REGIONS_CSV, GEO_SOURCE),
+               args, tuple(sorted(kwargs.items())))
+        result = result_cache().get(key, lambda: function(*args, **kwargs))
+        return result.copy() if hasattr(result, 'copy') else result
+
+    return query
+
+
+# Shared datasets: the returned frames are read-only, copy before modifying.
+# Sex stays coded 1/2, SEX_LABELS is applied to the chart data.
+
+# Counts by year, sex and name, summed over France ('national'), over each
+# region ('region') or kept by department ('department')
+def get_cube(level):
+    return dataset_store().get(
+        'cube_' + level, [NAMES_CSV, REGIONS_CSV], lambda: load_cube(level))
+
+
+# Counts of a cube by area, name and sex over all the years, for the
+# default full period
+def get_cube_summary(level):
+    return dataset_store().get(
+        f'summary_{level}', [NAMES_CSV, REGIONS_CSV],
+        lambda: load_summary(level))
+
+
+# Period totals per name and sex over France
+def get_prefix_sums(level='national'):
+    return dataset_store().get(
+        'prefix_sums_' + level, [NAMES_CSV, REGIONS_CSV],
+        lambda: PrefixSums(get_cube(level), CUBE_LEVELS[level]))
+
+
+# Keys (area, name, sex) of the summary of a cube, in which the partition
+# indexes of the cube place their series
+def get_cube_keys(level):
+    columns = CUBE_LEVELS[level] + ['preusuel', 'sexe']
+    return dataset_store().get(
+        'keys_' + level, [NAMES_CSV, REGIONS_CSV],
+        lambda: get_cube_summary(level)[columns])
+
+
+# Indexes of a cube answering the queries of a period: one per partition
+# (decade) of the period, each kept apart and evicted when not used, or
+# one over the summary (all the years as the first one) for the full
+# period. build(rows) makes an index from cube rows.
+def period_indexes(kind, level, period, build):
+    first_year, last_year = get_cube_bounds()
+    if period[0] <= first_year and period[1] >= last_year:
+        return [dataset_store().get(
+            f'{kind}_{level}_all', [NAMES_CSV, REGIONS_CSV],
+            lambda: build(get_cube_summary(level).assign(annais=first_year)))]
+    return [dataset_store().get(
+        f'{kind}_{level}_{partition}', [NAMES_CSV, REGIONS_CSV],
+        lambda partition=partition: build(load_cube(
+            level, (partition, partition + PARTITION_YEARS - 1))))
+        for partition in cube_partitions(level, period)]
+
+
+def get_cube_bounds():
+    years = get_cube('national')['annais']
+    return int(years.min()), int(years.max())
+
+
+# Period totals per name and sex of each region
+def get_region_sums(period):
+    keys = get_cube_keys('region')
+    return period_indexes(
+        'prefix_sums', 'region', period,
+        lambda rows: PrefixSums(rows, ['region_name'], keys))
+
+
+# Share of each name in each department or region, for the density map
+def get_area_shares(period):
+    departments = get_cube_keys('department')['dpt'].cat.categories
+    return period_indexes(
+        'area_shares', 'department', period,
+        lambda rows: AreaShares(rows, load_regions(), departments))
+
+
+# Yearly rank of every name, for the popularity curves
+def get_yearly_ranks():
+    return dataset_store().get(
+        'yearly_ranks', [NAMES_CSV, REGIONS_CSV],
+        lambda: YearlyRanks(get_cube('national')))
+
+
+# Male share of the names given to both sexes, for any period (built from
+# the national cube whatever the backend)
+def get_sex_shares():
+    return dataset_store().get(
+        'sex_shares', [NAMES_CSV, REGIONS_CSV],
+        lambda: SexShares(load_cube('national')))
+
+
+# Bursts, declines and steady years of all the names (names_trends.py)
+def get_trends():
+    return dataset_store().get(
+        'trends', [NAMES_CSV, REGIONS_CSV], load_trends)
+
+
+# Department or region polygons for the maps
+def get_geometries(granularity='region', precision='medium'):
+    return dataset_store().get(
+        f'geo_{granularity}_{precision}', [GEO_SOURCE, REGIONS_CSV],
+        lambda: load_geometries(granularity, precision))
+
+
+# Search of the names by prefix, most popular first
+def get_name_index():
+    if BACKEND != 'pandas':
+        name_popularity = import_module('names_' + BACKEND).name_popularity
+        return dataset_store().get(
+            'name_index', [NAMES_CSV, REGIONS_CSV],
+            lambda: NameIndex(name_popularity()))
+    return dataset_store().get(
+        'name_index', [NAMES_CSV, REGIONS_CSV],
+        lambda: NameIndex(get_cube('national')))
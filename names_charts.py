@@ -0,0 +1,349 @@
+# Altair charts of the apps, built from the frames of names_lib with only
+# the columns each chart encodes, given once to its layers
+#
+# st.altair_chart sends the datasets apart from the spec, in Arrow, once per
+# content. Outside of Streamlit (benchmark, exports), CHART_DATA chooses how
+# altair stores them:
+# - 'inline': values in the spec, without altair's 5000 rows limit
+# - 'json': one json file per dataset, loaded by url
+# - 'vegafusion': the transforms of the charts evaluated in Python when they
+#   are compiled, so that only the rows of the marks are in the spec (needs
+#   the optional vegafusion[embed] package)
+
+import os
+
+import altair as alt
+import pandas as pd
+
+CHART_DATA = os.environ.get('NAMES_CHART_DATA', 'inline')
+
+
+# Columns of the frame used by a chart, with the categories as plain
+# strings (Arrow would send every category of the names, not only the
+# ones of the chart) and without the index
+def chart_data(frame, columns):
+    data = frame[columns].reset_index(drop=True)
+    for column in columns:
+        if isinstance(data[column].dtype, pd.CategoricalDtype):
+            data[column] = data[column].astype(str)
+    return data
+
+
+def enable_chart_data(policy=CHART_DATA):
+    if policy == 'inline':
+        alt.data_transformers.enable('default', max_rows=None)
+    elif policy == 'json':
+        alt.data_transformers.enable('json')
+    elif policy == 'vegafusion':
+        alt.data_transformers.enable('vegafusion')
+    else:
+        raise ValueError(f'Unknown chart data policy: {policy}')
+
+
+# Charts of the apps, for a selection: displayed by the apps with
+# st.altair_chart and saved by export.py
+
+# Most names whose curves show the point and rank of every year
+MAX_LABELLED_NAMES = 10
+
+
+# Visualisation 1: top 20 male names (left) and female names (right)
+def top_20_chart(top_20_males, top_20_females):
+    # Invert the order for male names and set y-axis on the right
+    top_20_males = top_20_males.assign(nombre=-top_20_males['nombre'])
+
+    # Only the encoded columns, given once to the three layers of each chart
+    males_data = chart_data(top_20_males, ['preusuel', 'nombre', 'gender'])
+    females_data = chart_data(top_20_females, ['preusuel', 'nombre', 'gender'])
+
+    # Create the top names chart for males
+    top_males_chart = alt.Chart().mark_bar().encode(
+        x=alt.X('nombre:Q', title='', axis=alt.Axis(labels=True, format='~s')),
+        y=alt.Y('preusuel:N', title='', sort=None, axis=alt.Axis(
+            orient='left', labels=False, ticks=False)),
+        color=alt.value('blue'),
+        tooltip=[alt.Tooltip('preusuel:N', title='prenom'), alt.Tooltip(
+            'nombre:Q', title='nombre'), alt.Tooltip('gender:N', title='sexe')]
+    )
+
+    top_males_text = top_males_chart.mark_text(
+        align='right',
+        baseline='middle',
+        dx=-3
+    ).encode(
+        text='preusuel:N',
+        color=alt.value('white')
+    )
+
+    top_males_numbers = top_males_chart.mark_text(
+        align='left',
+        baseline='middle',
+        dx=3,
+        color='blue'
+    ).encode(
+        text='nombre:Q'
+    )
+
+    # Create the top names chart for females
+    top_females_chart = alt.Chart().mark_bar().encode(
+        x=alt.X('nombre:Q', title='', axis=alt.Axis(labels=True, format='~s')),
+        y=alt.Y('preusuel:N', title='', sort=None, axis=alt.Axis(
+            orient='right', labels=False, ticks=False)),
+        color=alt.value('pink'),
+        tooltip=[alt.Tooltip('preusuel:N', title='prenom'), alt.Tooltip(
+            'nombre:Q', title='nombre'), alt.Tooltip('gender:N', title='sexe')]
+    )
+
+    top_females_text = top_females_chart.mark_text(
+        align='left',
+        baseline='middle',
+        dx=3
+    ).encode(
+        text='preusuel:N',
+        color=alt.value('white')
+    )
+
+    top_females_numbers = top_females_chart.mark_text(
+        align='right',
+        baseline='middle',
+        dx=-3,
+        color='pink'
+    ).encode(
+        text='nombre:Q'
+    )
+
+    return alt.hconcat(
+        alt.layer(top_males_chart, top_males_text, top_males_numbers,
+                  data=males_data).properties(width=400, height=400),
+        alt.layer(top_females_chart, top_females_text, top_females_numbers,
+                  data=females_data).properties(width=400, height=400)
+    ).resolve_scale(
+        x='independent'
+    ).properties(
+        title='Top 20 des prénoms masculins et féminins les plus populaires'
+    ).configure_axis(
+        labelFontSize=12,
+        titleFontSize=14
+    ).configure_title(
+        fontSize=24, anchor='start'
+    )
+
+
+# Visualisation 1: yearly rank of the names, from rank_series (and
+# rank_ends, for the labels beyond MAX_LABELLED_NAMES names)
+def popularity_chart(name_rank_data, name_ends=None):
+    # Create a selection that allows zooming
+    zoom = alt.selection_interval(bind='scales')
+
+    # Beyond MAX_LABELLED_NAMES curves, the points and ranks of each year
+    # are left out: only the last rank of each name is drawn and labelled
+    # with the name
+    labelled = name_rank_data['preusuel'].nunique() <= MAX_LABELLED_NAMES
+
+    # Create the popularity over time chart
+    popularity = alt.Chart(chart_data(name_rank_data, ['annais', 'preusuel', 'rank'])).mark_line(
+        point=alt.OverlayMarkDef(color='orange') if labelled else False, color='orange').encode(
+        x=alt.X('annais:O', title='Année', axis=alt.Axis(format='d')),
+        y=alt.Y('rank:Q', title='Rang', scale=alt.Scale(
+            domain=(0, name_rank_data['rank'].max() + 1))),
+        color=alt.Color('preusuel:N', title='Prénom'),
+        tooltip=[alt.Tooltip('annais:O', title='annee'),
+                 alt.Tooltip('rank:Q', title='rang')]
+    ).properties(
+        title="Popularité des prénoms au cours des années",
+        width=1000,
+        height=600
+    ).add_selection(zoom)
+
+    if labelled:
+        popularity_text = popularity.mark_text(
+            align='left',
+            baseline='middle',
+            dx=5, dy=-5,
+            color='white'
+        ).encode(
+            text='rank:Q'
+        )
+    else:
+        popularity_text = alt.Chart(chart_data(name_ends, ['annais', 'preusuel', 'rank'])).mark_text(
+            align='left',
+            baseline='middle',
+            dx=5,
+            color='white'
+        ).encode(
+            x='annais:O',
+            y='rank:Q',
+            text='preusuel:N'
+        )
+
+    return alt.layer(
+        popularity, popularity_text
+    ).properties(
+        title="Popularité des prénoms au cours des années"
+    ).configure_title(
+        fontSize=24, anchor='start'
+    )
+
+
+# Visualisation 2: top names in France and in the selected region
+def top_region_chart(top_names_france, top_names_region, selected_region):
+    chart1 = alt.Chart(chart_data(
+        top_names_france, ['preusuel', 'sexe', 'nombre'])).mark_bar().encode(
+        x=alt.X('nombre:Q', title='Compte', axis=alt.Axis(format=',d')),
+        y=alt.Y('preusuel:N', sort='-x', title='Prénom'),
+        color=alt.Color('sexe:N', scale=alt.Scale(
+            domain=['Homme', 'Femme'], range=['blue', 'pink'])),
+        tooltip=['preusuel', 'nombre']
+    ).properties(
+        width=700,
+        height=600,
+        title='Top 20 national'
+    )
+
+    chart2 = alt.Chart(chart_data(
+        top_names_region, ['preusuel', 'sexe', 'nombre'])).mark_bar().encode(
+        x=alt.X('nombre:Q', title='Compte', axis=alt.Axis(format=',d'), scale=alt.Scale(domain=[0, max(
+            top_names_france['nombre'].max()/15, top_names_region['nombre'].max())])),
+        y=alt.Y('preusuel:N', sort='-x', title='Prénom'),
+        color=alt.Color('sexe:N', scale=alt.Scale(
+            domain=['Homme', 'Femme'], range=['blue', 'pink'])),
+        tooltip=['preusuel', 'nombre']
+    ).properties(
+        width=500,
+        height=600,
+        title=f'Top 20 - {selected_region}'
+    )
+
+    # Adjust the spacing between the two charts
+    return alt.hconcat(chart1, chart2).resolve_scale(x='independent')
+
+
+# Visualisation 3: years of presence in the top 20, from presence_bars
+def presence_chart(combined_presence):
+    return alt.Chart(chart_data(
+        combined_presence, ['preusuel', 'sexe', 'count'])).mark_bar().encode(
+        x=alt.X('count:Q', title='Années de présence dans le top 20'),
+        y=alt.Y('preusuel:N', sort='-x', title='Prénoms'),
+        color=alt.Color('sexe:N', scale=alt.Scale(
+            domain=['Homme', 'Femme'], range=['blue', 'pink'])),
+        tooltip=['preusuel', 'count']
+    ).properties(
+        width=800,
+        height=600
+    )
+
+
+# Visualisation 3: average year, years in the top 20 and births of the
+# names, from presence_scatter
+def presence_scatter_chart(scatter_data, period):
+    start_year, end_year = period
+    chart3 = alt.Chart(chart_data(scatter_data, [
+        'preusuel', 'sexe', 'annais', 'avg_years_in_top_20', 'nombre'])).mark_circle().encode(
+        x=alt.X('annais:Q', title='Année moyenne à laquelle un prénom est donné',
+                scale=alt.Scale(domain=[start_year, end_year]), axis=alt.Axis(format='d')),
+        y=alt.Y('avg_years_in_top_20:Q',
+                title='Nombre d\'années moyen dans le top 20'),
+        size=alt.Size('nombre:Q', title='Nombre total de naissances',
+                      scale=alt.Scale(range=[100, 2000])),
+        color=alt.Color('sexe:N', scale=alt.Scale(
+            domain=['Homme', 'Femme'], range=['blue', 'pink'])),
+        tooltip=[
+            alt.Tooltip('preusuel:N', title='Prénom'),
+            alt.Tooltip('annais:Q', title='Année moyenne'),
+            alt.Tooltip('avg_years_in_top_20:Q', title='Cumul années top 20'),
+            alt.Tooltip('nombre:Q', title='Nombre de naissances')
+        ]
+    ).properties(
+        width=800,
+        height=600
+    ).interactive()
+
+    # Customize legend to ensure visibility on dark background
+    return chart3.configure_legend(
+        labelColor='white',
+        titleColor='white',
+        titleFontSize=12,
+        labelFontSize=10,
+        symbolFillColor='white',
+        symbolStrokeColor='black',
+        symbolStrokeWidth=1,
+        symbolSize=200
+    )
+
+
+# Visualisation 3: drift of the male share of the names given to both
+# sexes, from epicene_names
+def epicene_drift_chart(epicene):
+    return alt.Chart(chart_data(epicene, [
+        'preusuel', 'drift', 'male_share', 'crossovers', 'nombre'])).mark_bar().encode(
+        x=alt.X('drift:Q', title='Évolution de la part des garçons sur la période',
+                axis=alt.Axis(format='+%'), scale=alt.Scale(domain=[-1, 1])),
+        y=alt.Y('preusuel:N', sort=alt.EncodingSortField(
+            'drift', order='descending'), title='Prénoms'),
+        color=alt.condition(alt.datum.drift > 0, alt.value('blue'),
+                            alt.value('pink')),
+        tooltip=[
+            alt.Tooltip('preusuel:N', title='Prénom'),
+            alt.Tooltip('drift:Q', title='Évolution', format='+.1%'),
+            alt.Tooltip('male_share:Q', title='Part des garçons', format='.1%'),
+            alt.Tooltip('crossovers:Q', title='Changements de majorité'),
+            alt.Tooltip('nombre:Q', title='Nombre de naissances')
+        ]
+    ).properties(
+        width=800,
+        height=600
+    )
+
+
+# Visualisation 3: yearly male share of names given to both sexes, from
+# sex_share_series
+def sex_share_chart(share_series):
+    shares = alt.Chart().mark_line(point=True).encode(
+        x=alt.X('annais:O', title='Année', axis=alt.Axis(format='d')),
+        y=alt.Y('male_share:Q', title='Part des garçons',
+                axis=alt.Axis(format='%'), scale=alt.Scale(domain=[0, 1])),
+        color=alt.Color('preusuel:N', title='Prénom'),
+        tooltip=[alt.Tooltip('preusuel:N', title='Prénom'),
+                 alt.Tooltip('annais:O', title='Année'),
+                 alt.Tooltip('male_share:Q', title='Part des garçons',
+                             format='.1%'),
+                 alt.Tooltip('nombre:Q', title='Nombre de naissances')]
+    )
+
+    # Half of the births to each sex
+    parity = alt.Chart().mark_rule(color='white', strokeDash=[4, 4]).encode(
+        y=alt.datum(0.5))
+
+    return alt.layer(
+        shares, parity,
+        data=chart_data(share_series, ['annais', 'preusuel', 'male_share', 'nombre'])
+    ).properties(
+        width=1000,
+        height=500
+    ).interactive()
+
+
+# Visualisation 1: names of the strongest bursts or declines, or with the
+# most steady years, from trending_names
+def trend_chart(trending, kind):
+    if kind == 'steady':
+        x = alt.X('years:Q', title='Années stables dans la période')
+    else:
+        x = alt.X('score:Q', title='Écart à la popularité des 10 années précédentes (z-score)')
+    colors = {'burst': 'orange', 'decline': 'steelblue', 'steady': 'seagreen'}
+    return alt.Chart(chart_data(trending, [
+        'preusuel', 'annais', 'score', 'share', 'years'])).mark_bar(
+        color=colors[kind]).encode(
+        x=x,
+        y=alt.Y('preusuel:N', sort=None, title='Prénoms'),
+        tooltip=[
+            alt.Tooltip('preusuel:N', title='Prénom'),
+            alt.Tooltip('annais:O', title='Année'),
+            alt.Tooltip('score:Q', title='z-score', format='.1f'),
+            alt.Tooltip('share:Q', title='Part des naissances', format='.3%'),
+            alt.Tooltip('years:Q', title='Années')
+        ]
+    ).properties(
+        width=800,
+        height=500
+    )
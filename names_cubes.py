@@ -0,0 +1,302 @@
+# Pre-aggregated cubes of the names counts by year, sex and area, stored
+# as one Parquet file per decade so that a period only reads its decades,
+# with a summary of each cube over all the years. One process of the
+# machine builds them at a time, the others wait and read its files.
+#
+# Build them offline with: python3 names_cubes.py
+
+import json
+import os
+import tempfile
+
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+from names_data import (CACHE_DIR, NAMES_CSV, REGIONS_CSV, cache_is_fresh,
+                        cache_paths, clean_names, file_lock, load_names, load_regions,
+                        partial_path, read_cache, replace_directory,
+                        update_cache, with_regions, write_json)
+from names_engine import by_year
+
+# Rows of the Parquet row groups: the cubes being sorted by year, a query
+# on a period only reads the groups of its years (names_duckdb.py)
+ROW_GROUP_ROWS = 50_000
+
+# Years of each partition file (partitions start at multiples of it)
+PARTITION_YEARS = 10
+
+CATEGORICAL_COLUMNS = ['preusuel', 'region_name', 'dpt']
+
+# Area columns of each cube, on top of (annais, sexe, preusuel)
+CUBE_LEVELS = {
+    'national': [],
+    'region': ['region_name'],
+    'department': ['dpt'],
+}
+
+
+# Directory of the partition files of a cube
+def cube_path(level, csv_path=NAMES_CSV):
+    base = os.path.splitext(os.path.basename(csv_path))[0]
+    return os.path.join(CACHE_DIR, f'{base}_cube_{level}')
+
+
+def partition_path(level, partition, csv_path=NAMES_CSV):
+    return os.path.join(cube_path(level, csv_path), f'{partition}.parquet')
+
+
+# Counts of the cube summed over all the years
+def summary_path(level, csv_path=NAMES_CSV):
+    return cube_path(level, csv_path) + '_all.parquet'
+
+
+def cubes_meta_path(csv_path=NAMES_CSV):
+    base = os.path.splitext(os.path.basename(csv_path))[0]
+    return os.path.join(CACHE_DIR, f'{base}_cubes.json')
+
+
+# Partition of years (a year or an array of years)
+def partition_of(years):
+    return years // PARTITION_YEARS * PARTITION_YEARS
+
+
+# Version of the sources the cubes are built from, with the fingerprint of
+# each year of names
+def cubes_signature(csv_path=NAMES_CSV, regions_path=REGIONS_CSV):
+    with open(cache_paths(csv_path)[1]) as f:
+        names_meta = json.load(f)
+    stat = os.stat(regions_path)
+    return {'sha1': names_meta['sha1'],
+            'regions': [stat.st_mtime, stat.st_size],
+            'years': names_meta.get('years')}
+
+
+def aggregate_rows(names, by):
+    keys = ['annais', 'sexe'] + by + ['preusuel']
+    return names.groupby(keys, observed=True).agg(
+        nombre=('nombre', 'sum'), n_dpt=('nombre', 'size')).reset_index()
+
+
+# Sum of the counts by year, sex, area and name. n_dpt is the number of
+# department rows behind each count, to keep per-row averages exact.
+# The years are aggregated in parallel with the 'processes' engine.
+def aggregate(names, by, engine=None, workers=None):
+    cube = by_year(aggregate_rows, names, by, engine=engine, workers=workers)
+    cube['nombre'] = cube['nombre'].astype('int32')
+    cube['n_dpt'] = cube['n_dpt'].astype('int16')
+    cube['preusuel'] = cube['preusuel'].cat.remove_unused_categories()
+    return cube
+
+
+# Lock of the cube files, shared by the processes of the machine
+def cubes_lock(csv_path=NAMES_CSV):
+    return file_lock(cubes_meta_path(csv_path))
+
+
+def build_cubes(csv_path=NAMES_CSV, regions_path=REGIONS_CSV, engine=None):
+    with cubes_lock(csv_path):
+        return write_cubes(csv_path, regions_path, engine)
+
+
+# Each cube is written in a directory of this process then swapped, the
+# signature last: call it under cubes_lock
+def write_cubes(csv_path=NAMES_CSV, regions_path=REGIONS_CSV, engine=None):
+    names = clean_names(load_names(csv_path))
+
+    # Departments missing from the regions file are left out of the
+    # region cube, like with the merge of the apps
+    regions = with_regions(names, load_regions(regions_path))
+
+    cubes = {}
+    for level, by in CUBE_LEVELS.items():
+        cubes[level] = aggregate(regions if level == 'region' else names, by,
+                                 engine=engine)
+        path = cube_path(level, csv_path)
+        partial = tempfile.mkdtemp(dir=CACHE_DIR,
+                                   prefix='.' + os.path.basename(path) + '.')
+        os.chmod(partial, 0o755)
+        write_partitions(partial, cubes[level])
+        replace_directory(partial, path)
+        write_parquet(summarize(cubes[level], by),
+                      summary_path(level, csv_path))
+
+    write_json(cubes_signature(csv_path, regions_path),
+               cubes_meta_path(csv_path))
+    return cubes
+
+
+# Write a Parquet file of this process then swap it in
+def write_parquet(frame, path, **kwargs):
+    partial = partial_path(path)
+    frame.to_parquet(partial, index=False, **kwargs)
+    os.replace(partial, path)
+
+
+# Write the partitions of the cube rows in a cube directory, or rewrite the
+# given partitions (removing the ones without rows left)
+def write_partitions(directory, cube, partitions=None):
+    keys = partition_of(cube['annais'].to_numpy())
+    if partitions is None:
+        partitions = sorted(set(keys))
+    for partition in partitions:
+        rows = cube[keys == partition]
+        path = os.path.join(directory, f'{partition}.parquet')
+        if len(rows):
+            write_parquet(rows, path, row_group_size=ROW_GROUP_ROWS)
+        elif os.path.exists(path):
+            os.remove(path)
+
+
+# Counts by area, name and sex over all the years of the cube rows
+def summarize(cube, by):
+    summary = cube.groupby(by + ['preusuel', 'sexe'], observed=True)[
+        'nombre'].sum().astype('int64').reset_index()
+    return summary[summary['nombre'] != 0].reset_index(drop=True)
+
+
+# Cube parts read or built apart, as one frame whose categories are the
+# union of theirs, sorted alphabetically
+def concat_cubes(parts):
+    categories = {
+        column: union_categoricals(
+            [part[column] for part in parts],
+            sort_categories=True).remove_unused_categories()
+        for column in CATEGORICAL_COLUMNS if column in parts[0]}
+    cube = pd.concat([part.drop(columns=list(categories)) for part in parts],
+                     ignore_index=True)
+    for column, values in categories.items():
+        cube[column] = values
+    return cube[parts[0].columns]
+
+
+# Rows of the cube in the order of aggregate
+def sort_cube(cube):
+    keys = [column for column in cube.columns
+            if column not in ('nombre', 'n_dpt')]
+    return cube.sort_values(keys, ignore_index=True)
+
+
+# Years whose rows changed (corrected, added or removed) since the cubes
+# were built, None if the cubes have to be built again
+def changed_years(csv_path=NAMES_CSV, regions_path=REGIONS_CSV):
+    if not all(os.path.exists(path) for path in
+               [cubes_meta_path(csv_path)]
+               + [cube_path(level, csv_path) for level in CUBE_LEVELS]
+               + [summary_path(level, csv_path) for level in CUBE_LEVELS]):
+        return None
+    with open(cubes_meta_path(csv_path)) as f:
+        meta = json.load(f)
+    signature = cubes_signature(csv_path, regions_path)
+    if (meta['regions'] != signature['regions'] or not meta.get('years')
+            or not signature['years']):
+        return None
+    return sorted(int(year) for year in meta['years'].keys()
+                  | signature['years'].keys()
+                  if meta['years'].get(year) != signature['years'].get(year))
+
+
+# Aggregate again only the years of a new csv (new vintage, corrected
+# rows) that differ from the cubes, and rewrite only their partitions and
+# the summaries. One process updates them at a time.
+def update_cubes(csv_path=NAMES_CSV, regions_path=REGIONS_CSV, engine=None):
+    with cubes_lock(csv_path):
+        # Updated by another process while waiting for the lock
+        if not cubes_are_fresh(csv_path, regions_path):
+            write_changes(csv_path, regions_path, engine)
+
+
+def write_changes(csv_path=NAMES_CSV, regions_path=REGIONS_CSV, engine=None):
+    update_cache(csv_path)
+    years = changed_years(csv_path, regions_path)
+    if years is None:
+        write_cubes(csv_path, regions_path, engine)
+        return
+
+    if years:
+        names = clean_names(read_cache(csv_path, years))
+        regions = with_regions(names, load_regions(regions_path))
+        partitions = sorted({partition_of(year) for year in years})
+        for level, by in CUBE_LEVELS.items():
+            rows = aggregate(regions if level == 'region' else names, by,
+                             engine=engine)
+            old = [pd.read_parquet(partition_path(level, partition, csv_path))
+                   for partition in partitions
+                   if os.path.exists(partition_path(level, partition,
+                                                    csv_path))]
+            kept = [part[~part['annais'].isin(years)] for part in old]
+            write_partitions(cube_path(level, csv_path),
+                             sort_cube(concat_cubes(kept + [rows])), partitions)
+
+            # Summary minus the previous counts of the years plus the new
+            removed = [part[part['annais'].isin(years)] for part in old]
+            removed = [part.assign(nombre=-part['nombre'].astype('int64'))
+                       for part in removed]
+            summary = concat_cubes([
+                pd.read_parquet(summary_path(level, csv_path)),
+                summarize(concat_cubes(removed + [rows]), by)])
+            write_parquet(summarize(summary, by), summary_path(level, csv_path))
+
+    write_json(cubes_signature(csv_path, regions_path),
+               cubes_meta_path(csv_path))
+
+
+def cubes_are_fresh(csv_path=NAMES_CSV, regions_path=REGIONS_CSV):
+    if not cache_is_fresh(csv_path):
+        return False
+    if not all(os.path.exists(cube_path(level, csv_path))
+               and os.path.exists(summary_path(level, csv_path))
+               for level in CUBE_LEVELS):
+        return False
+    if not os.path.exists(cubes_meta_path(csv_path)):
+        return False
+    with open(cubes_meta_path(csv_path)) as f:
+        meta = json.load(f)
+    return meta == cubes_signature(csv_path, regions_path)
+
+
+# Partitions of a cube with years in the period (all if None), updating
+# the cubes first if the sources changed (in the process: the apps never
+# fork a pool of processes)
+def cube_partitions(level, period=None, csv_path=NAMES_CSV,
+                    regions_path=REGIONS_CSV):
+    if not cubes_are_fresh(csv_path, regions_path):
+        update_cubes(csv_path, regions_path, engine='pandas')
+    partitions = sorted(int(os.path.splitext(name)[0])
+                        for name in os.listdir(cube_path(level, csv_path))
+                        if not name.startswith('.'))
+    if period is not None:
+        start_year, end_year = period
+        partitions = [partition for partition in partitions
+                      if partition_of(start_year) <= partition <= end_year]
+    return partitions
+
+
+# Load one cube, or its rows of a period (reading only its partitions)
+def load_cube(level, period=None, csv_path=NAMES_CSV,
+              regions_path=REGIONS_CSV):
+    partitions = cube_partitions(level, period, csv_path, regions_path)
+    parts = [pd.read_parquet(partition_path(level, partition, csv_path))
+             for partition in partitions]
+    if not parts:
+        parts = [pd.read_parquet(partition_path(
+            level, cube_partitions(level)[0], csv_path)).head(0)]
+    cube = concat_cubes(parts)
+    if period is not None:
+        start_year, end_year = period
+        cube = cube[(cube['annais'] >= start_year)
+                    & (cube['annais'] <= end_year)].reset_index(drop=True)
+    return cube
+
+
+# Counts of a cube by area, name and sex over all the years
+def load_summary(level, csv_path=NAMES_CSV, regions_path=REGIONS_CSV):
+    if not cubes_are_fresh(csv_path, regions_path):
+        update_cubes(csv_path, regions_path, engine='pandas')
+    return pd.read_parquet(summary_path(level, csv_path))
+
+
+if __name__ == '__main__':
+    rows = len(clean_names(load_names()))
+    for level, cube in build_cubes().items():
+        print(f'{level}: {len(cube)} rows ({rows / len(cube):.0f}x fewer), '
+              f'{cube.memory_usage(deep=True).sum() / 1024 ** 2:.1f} MB')
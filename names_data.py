@@ -0,0 +1,303 @@
+# Shared data access for the baby names visualisations
+
+import fcntl
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+from contextlib import contextmanager
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+DATA_DIR = 'data'
+NAMES_CSV = os.path.join(DATA_DIR, 'dpt2020.csv')
+REGIONS_CSV = os.path.join(DATA_DIR, 'departements-region.csv')
+CACHE_DIR = os.path.join(DATA_DIR, 'cache')
+
+# The csv columns are read as text and converted chunk by chunk, so that
+# a blank or malformed value is a rejected row rather than a parse error
+CSV_DTYPES = {'sexe': str, 'preusuel': str,
+              'annais': str, 'dpt': str, 'nombre': str}
+
+# Types of the columnar cache: names and departments are dictionary
+# encoded with the same index width in every chunk, whatever the number of
+# names of the first one
+CACHE_FIELDS = {
+    'sexe': pa.int8(),
+    'preusuel': pa.dictionary(pa.int32(), pa.string()),
+    'annais': pa.int16(),
+    'dpt': pa.dictionary(pa.int32(), pa.string()),
+    'nombre': pa.int32(),
+}
+
+SEX_LABELS = {1: 'Homme', 2: 'Femme'}
+
+# Rows read at once from the csv
+CHUNK_ROWS = 500_000
+
+# Rows dropped while reading the csv, checked in this order
+REJECTION_RULES = ['annee_inconnue', 'prenoms_rares', 'departement_inconnu',
+                   'ligne_invalide']
+
+
+# Path of the cache file and of its metadata for a given csv
+def cache_paths(csv_path=NAMES_CSV):
+    base = os.path.splitext(os.path.basename(csv_path))[0]
+    return (os.path.join(CACHE_DIR, base + '.parquet'),
+            os.path.join(CACHE_DIR, base + '.json'))
+
+
+# Hash of the csv content, used when the mtime changed
+def file_hash(path):
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+# Lock of files built by the processes of the machine (cache, cubes,
+# tensor), held on path + '.lock': exclusive to build them, shared to read
+@contextmanager
+def file_lock(path, shared=False):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + '.lock', 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+# New file of this process next to path (hidden, so never listed as a
+# partition), written then swapped in with os.replace
+def partial_path(path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    handle, partial = tempfile.mkstemp(dir=os.path.dirname(path),
+                                       prefix='.' + os.path.basename(path) + '.')
+    os.close(handle)
+    os.chmod(partial, 0o644)
+    return partial
+
+
+def write_json(data, path):
+    partial = partial_path(path)
+    with open(partial, 'w') as f:
+        json.dump(data, f)
+    os.replace(partial, path)
+
+
+# Swap a directory written by this process in place of path: the processes
+# still reading the previous files keep them until they open the new ones
+def replace_directory(partial, path):
+    if not os.path.exists(path):
+        os.replace(partial, path)
+        return
+    previous = tempfile.mkdtemp(dir=os.path.dirname(path),
+                                prefix='.' + os.path.basename(path) + '.')
+    os.replace(path, os.path.join(previous, 'previous'))
+    os.replace(partial, path)
+    shutil.rmtree(previous)
+
+
+# Read the raw INSEE csv (department 'dpt' or national 'nat' file) by
+# chunks of typed, valid rows. rejected counts the rows dropped per rule.
+def read_names_chunks(csv_path=NAMES_CSV, rejected=None,
+                      chunk_rows=CHUNK_ROWS):
+    if rejected is None:
+        rejected = {}
+    for rule in REJECTION_RULES:
+        rejected.setdefault(rule, 0)
+
+    chunks = pd.read_csv(csv_path, sep=";", dtype=CSV_DTYPES,
+                         chunksize=chunk_rows)
+    for chunk in chunks:
+        years = pd.to_numeric(chunk['annais'], errors='coerce')
+        sexes = pd.to_numeric(chunk['sexe'], errors='coerce')
+        counts = pd.to_numeric(chunk['nombre'], errors='coerce')
+        rules = {
+            'annee_inconnue': years.isna(),
+            'prenoms_rares': chunk['preusuel'] == '_PRENOMS_RARES',
+            'departement_inconnu': (chunk['dpt'] == 'XX'
+                                    if 'dpt' in chunk else False),
+            'ligne_invalide': (~sexes.isin(SEX_LABELS)
+                               | chunk['preusuel'].isna()
+                               | ~(counts > 0) | (counts % 1 != 0)),
+        }
+
+        # Each dropped row is counted under the first rule it breaks
+        keep = pd.Series(True, index=chunk.index)
+        for rule in REJECTION_RULES:
+            broken = keep & rules[rule]
+            rejected[rule] += int(broken.sum())
+            keep &= ~broken
+
+        chunk = chunk[keep].assign(sexe=sexes[keep].astype('int8'),
+                                   annais=years[keep].astype('int16'),
+                                   nombre=counts[keep].astype('int32'))
+        for column in ['preusuel', 'dpt']:
+            if column in chunk:
+                chunk[column] = chunk[column].astype('category')
+        yield chunk.reset_index(drop=True)
+
+
+# Check the cache metadata against the csv: the csv is hashed only when
+# its mtime or size changed
+def cache_is_fresh(csv_path=NAMES_CSV):
+    cache_path, meta_path = cache_paths(csv_path)
+    if not (os.path.exists(cache_path) and os.path.exists(meta_path)):
+        return False
+
+    with open(meta_path) as f:
+        meta = json.load(f)
+    stat = os.stat(csv_path)
+    if meta['mtime'] == stat.st_mtime and meta['size'] == stat.st_size:
+        return True
+
+    if meta['sha1'] != file_hash(csv_path):
+        return False
+
+    # Same content with a new mtime (copy, checkout...): refresh the metadata
+    meta['mtime'], meta['size'] = stat.st_mtime, stat.st_size
+    write_json(meta, meta_path)
+    return True
+
+
+# Fingerprint of the rows of each year, whatever their order and chunk:
+# sum of the row hashes modulo 2 ** 64
+def year_hashes(chunk, hashes):
+    rows = pd.util.hash_pandas_object(chunk, index=False)
+    for year, total in rows.groupby(chunk['annais'].to_numpy()).sum().items():
+        hashes[str(year)] = (hashes.get(str(year), 0) + int(total)) % 2 ** 64
+
+
+# Convert the csv to the columnar cache, one chunk at a time, in a file of
+# this process swapped in at the end. Call it under the cache lock
+# (update_cache, build_cache).
+def write_cache(csv_path=NAMES_CSV, chunk_rows=CHUNK_ROWS):
+    cache_path, meta_path = cache_paths(csv_path)
+
+    rejected = {}
+    hashes = {}
+    rows = 0
+    writer = None
+    partial = partial_path(cache_path)
+    for chunk in read_names_chunks(csv_path, rejected, chunk_rows):
+        schema = pa.schema([(column, CACHE_FIELDS[column])
+                            for column in chunk.columns])
+        table = pa.Table.from_pandas(chunk, schema=schema,
+                                     preserve_index=False)
+        if writer is None:
+            writer = pq.ParquetWriter(partial, schema)
+        writer.write_table(table)
+        year_hashes(chunk, hashes)
+        rows += len(chunk)
+    if writer is None:
+        pd.DataFrame(columns=list(CSV_DTYPES)).to_parquet(partial)
+    else:
+        writer.close()
+    os.replace(partial, cache_path)
+
+    stat = os.stat(csv_path)
+    meta = {'mtime': stat.st_mtime, 'size': stat.st_size,
+            'sha1': file_hash(csv_path), 'rows': rows, 'rejected': rejected,
+            'years': {year: f'{hashes[year]:016x}' for year in sorted(hashes)}}
+    write_json(meta, meta_path)
+    return meta
+
+
+def build_cache(csv_path=NAMES_CSV, chunk_rows=CHUNK_ROWS):
+    with file_lock(cache_paths(csv_path)[0]):
+        write_cache(csv_path, chunk_rows)
+    return read_cache(csv_path)
+
+
+# Write the cache if the csv changed, by one process at a time
+def update_cache(csv_path=NAMES_CSV):
+    if cache_is_fresh(csv_path):
+        return
+    with file_lock(cache_paths(csv_path)[0]):
+        # Written by another process while waiting for the lock
+        if not cache_is_fresh(csv_path):
+            write_cache(csv_path)
+
+
+# The chunks have their own dictionaries: sort the unified categories so
+# that codes follow the alphabetical order of the names. years restricts
+# the rows read to these years.
+def read_cache(csv_path=NAMES_CSV, years=None):
+    filters = None if years is None else [('annais', 'in', list(years))]
+    names = pd.read_parquet(cache_paths(csv_path)[0], filters=filters)
+    for column in ['preusuel', 'dpt']:
+        if column in names:
+            names[column] = names[column].astype('category')
+            names[column] = names[column].cat.reorder_categories(
+                sorted(names[column].cat.categories))
+    return names
+
+
+# Load the names table, re-parsing the csv only when it changed
+def load_names(csv_path=NAMES_CSV):
+    update_cache(csv_path)
+    return read_cache(csv_path)
+
+
+# Names without the rare names and the unknown departments
+def clean_names(names):
+    names = names[names['preusuel'] != '_PRENOMS_RARES']
+    if 'dpt' in names:
+        names = names[names['dpt'] != 'XX']
+    return names.reset_index(drop=True)
+
+
+# Departments with their name and region
+def load_regions(regions_path=REGIONS_CSV):
+    return pd.read_csv(regions_path, dtype=str)
+
+
+# Region of each department of an index, as codes into the sorted region
+# names (-1 for a department without region)
+def region_codes(departments, regions):
+    region_of = regions.set_index('num_dep')['region_name']
+    region_of = region_of.reindex(departments)
+    region_names = pd.Index(region_of.dropna().unique()).sort_values()
+    return region_names, region_names.get_indexer(region_of)
+
+
+# Names with a categorical region looked up from the department codes (one
+# byte per row instead of the strings of a merge), without the departments
+# that have no region
+def with_regions(names, regions):
+    region_names, codes = region_codes(names['dpt'].cat.categories, regions)
+    region = pd.Categorical.from_codes(
+        codes[names['dpt'].cat.codes.to_numpy()], region_names)
+    names = names.assign(region_name=region)
+    return names.dropna(subset=['region_name']).reset_index(drop=True)
+
+
+if __name__ == '__main__':
+    build_cache()
+    with open(cache_paths()[1]) as f:
+        meta = json.load(f)
+    print(f"{meta['rows']} rows kept, rejected: {meta['rejected']}")
+
+    def megabytes(names):
+        return names.memory_usage(deep=True).sum() / 1024 ** 2
+
+    # Table as the apps used to keep it: strings for names, departments, sex
+    # and regions (merge), 64 bit ints
+    legacy = pd.read_csv(NAMES_CSV, sep=";", dtype={'dpt': str})
+    legacy['annais'] = pd.to_numeric(legacy['annais'], errors='coerce')
+    legacy = legacy.dropna(subset=['annais'])
+    legacy['annais'] = legacy['annais'].astype(int)
+    legacy = legacy[legacy['preusuel'] != '_PRENOMS_RARES']
+    legacy['sexe'] = legacy['sexe'].map(SEX_LABELS)
+    legacy = legacy.merge(load_regions(), left_on='dpt', right_on='num_dep')
+
+    compact = with_regions(clean_names(load_names()), load_regions())
+    print(f'{len(legacy)} rows: {megabytes(legacy):.1f} MB before, '
+          f'{len(compact)} rows: {megabytes(compact):.1f} MB now '
+          f'({megabytes(legacy) / megabytes(compact):.1f}x less)')
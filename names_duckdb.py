@@ -0,0 +1,174 @@
+# DuckDB backend of the chart data (NAMES_BACKEND=duckdb): parameterised
+# SQL over the Parquet cubes of data/cache, instead of the cubes and
+# indexes held in memory by each Streamlit process
+#
+# The cubes are stored by decade and sorted by year, so DuckDB only reads
+# the row groups of the selected period. Several app instances can query
+# the same files.
+# Needs the optional duckdb package.
+
+import os
+import threading
+
+import duckdb
+
+from names_cubes import CUBE_LEVELS, cube_path, cubes_are_fresh, update_cubes
+from names_data import REGIONS_CSV
+
+CONNECTION = None
+CONNECTION_LOCK = threading.Lock()
+
+
+# Cursor of the process connection, on which the cubes ('national',
+# 'region', 'department') and the regions file ('regions') are views.
+# The cubes are built or updated first if out of date.
+def cursor():
+    global CONNECTION
+    with CONNECTION_LOCK:
+        if not cubes_are_fresh():
+            update_cubes(engine='pandas')
+        if CONNECTION is None:
+            CONNECTION = duckdb.connect()
+            for level in CUBE_LEVELS:
+                files = os.path.join(cube_path(level), '*.parquet')
+                CONNECTION.execute(
+                    f"CREATE VIEW {level} AS "
+                    f"SELECT * FROM read_parquet('{files}')")
+            CONNECTION.execute(
+                f"CREATE VIEW regions AS "
+                f"SELECT * FROM read_csv('{REGIONS_CSV}', all_varchar = true)")
+        return CONNECTION.cursor()
+
+
+# The numpy scalars of the apps (years of the slider) as Python values,
+# which DuckDB can bind
+def query(sql, **parameters):
+    parameters = {key: value.item() if hasattr(value, 'item') else value
+                  for key, value in parameters.items()}
+    return cursor().execute(sql, parameters).df()
+
+
+def year_bounds():
+    first_year, last_year = cursor().execute(
+        'SELECT min(annais), max(annais) FROM national').fetchone()
+    return int(first_year), int(last_year)
+
+
+# Births per name and sex over the period, in France or in a region
+def name_totals(period, region=None):
+    start_year, end_year = period
+    if region is None:
+        return query('''
+            SELECT preusuel, sexe, sum(nombre)::BIGINT AS nombre FROM national
+            WHERE annais BETWEEN $start AND $end
+            GROUP BY preusuel, sexe ORDER BY preusuel, sexe
+        ''', start=start_year, end=end_year)
+    return query('''
+        SELECT preusuel, sexe, sum(nombre)::BIGINT AS nombre FROM region
+        WHERE annais BETWEEN $start AND $end AND region_name = $region
+        GROUP BY preusuel, sexe ORDER BY preusuel, sexe
+    ''', start=start_year, end=end_year, region=region)
+
+
+# The k names of a sex with the most births over the period
+def top_names(period, sex, k, region=None):
+    start_year, end_year = period
+    table, area = 'national', ''
+    parameters = {'start': start_year, 'end': end_year, 'sex': sex, 'k': k}
+    if region is not None:
+        table, area = 'region', 'AND region_name = $region'
+        parameters['region'] = region
+    return query(f'''
+        SELECT preusuel, sexe, sum(nombre)::BIGINT AS nombre FROM {table}
+        WHERE annais BETWEEN $start AND $end AND sexe = $sex {area}
+        GROUP BY preusuel, sexe ORDER BY nombre DESC, preusuel LIMIT $k
+    ''', **parameters)
+
+
+def period_regions(period):
+    start_year, end_year = period
+    return list(query('''
+        SELECT DISTINCT region_name FROM region
+        WHERE annais BETWEEN $start AND $end ORDER BY region_name
+    ''', start=start_year, end=end_year)['region_name'])
+
+
+# Yearly rank of the names among all the names (both sexes together)
+def rank_series(names, period):
+    start_year, end_year = period
+    return query('''
+        WITH yearly AS (
+            SELECT annais, preusuel, sum(nombre)::BIGINT AS nombre
+            FROM national WHERE annais BETWEEN $start AND $end
+            GROUP BY annais, preusuel
+        ), ranked AS (
+            SELECT annais, preusuel, row_number() OVER (
+                PARTITION BY annais ORDER BY nombre DESC, preusuel) AS rank
+            FROM yearly
+        )
+        SELECT * FROM ranked WHERE list_contains($names, preusuel)
+        ORDER BY annais, preusuel
+    ''', start=start_year, end=end_year, names=list(names))
+
+
+# Births of the name, of all names and their ratio over the period, per
+# region or department, where the name is given
+def region_density(name, period, granularity='region'):
+    start_year, end_year = period
+    area = 'region_name' if granularity == 'region' else 'dpt'
+    rows = 'department'
+    if granularity == 'region':
+        rows = 'department JOIN regions ON dpt = num_dep'
+    return query(f'''
+        WITH births AS (
+            SELECT {area}, preusuel, nombre FROM {rows}
+            WHERE annais BETWEEN $start AND $end
+        )
+        SELECT {area}, nombre_name, nombre_total,
+               nombre_name / nombre_total AS density
+        FROM (SELECT {area}, sum(nombre)::BIGINT AS nombre_name FROM births
+              WHERE preusuel = $name GROUP BY {area})
+        JOIN (SELECT {area}, sum(nombre)::BIGINT AS nombre_total FROM births
+              GROUP BY {area}) USING ({area})
+        ORDER BY {area}
+    ''', start=start_year, end=end_year, name=name)
+
+
+# The k names of each year and sex with the most births
+def top_each_year(period, k):
+    start_year, end_year = period
+    return query('''
+        SELECT annais, sexe, preusuel, nombre FROM national
+        WHERE annais BETWEEN $start AND $end
+        QUALIFY row_number() OVER (
+            PARTITION BY annais, sexe ORDER BY nombre DESC, preusuel) <= $k
+        ORDER BY annais, sexe, nombre DESC, preusuel
+    ''', start=start_year, end=end_year, k=k)
+
+
+# Number of distinct names of each sex given over the period
+def name_counts(period):
+    start_year, end_year = period
+    return query('''
+        SELECT sexe, count(DISTINCT preusuel) AS unique_names FROM national
+        WHERE annais BETWEEN $start AND $end GROUP BY sexe ORDER BY sexe
+    ''', start=start_year, end=end_year)
+
+
+# Rows of the national cube of a few names over the period
+def national_rows(period, names):
+    start_year, end_year = period
+    return query('''
+        SELECT * FROM national
+        WHERE annais BETWEEN $start AND $end
+          AND list_contains($names, preusuel)
+        ORDER BY annais, sexe, preusuel
+    ''', start=start_year, end=end_year, names=list(names))
+
+
+# Births of each name, for the name search
+def name_popularity():
+    return query('''
+        SELECT preusuel, sum(nombre)::BIGINT AS nombre FROM national
+        GROUP BY preusuel
+    ''')
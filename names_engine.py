@@ -0,0 +1,90 @@
+# Engine of the heavy aggregations (cubes, top k of each year): 'pandas'
+# in the process, or 'processes' where the rows are split by year and the
+# parts aggregated in a pool of processes, one per cpu by default. Only the
+# offline cube builds (names_cubes.py, the export before it starts its
+# workers) use the processes: the apps and the export workers aggregate in
+# their own process, so a pool is never forked from the server threads.
+#
+# NAMES_ENGINE=processes python3 names_cubes.py
+# Scaling with the number of processes: python3 names_engine.py
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+ENGINES = ['pandas', 'processes']
+ENGINE = os.environ.get('NAMES_ENGINE', 'pandas')
+WORKERS = int(os.environ.get('NAMES_WORKERS', os.cpu_count()))
+
+# Below this number of rows, the processes cost more than they save
+MIN_PARALLEL_ROWS = 200_000
+
+
+# Parts of the frame with consecutive years and about the same number of
+# rows each (a year is never split)
+def year_parts(frame, parts):
+    counts = frame['annais'].value_counts().sort_index()
+    edges = np.searchsorted(
+        counts.cumsum().to_numpy(),
+        np.arange(1, parts) * len(frame) / parts)
+    part = np.searchsorted(counts.index.to_numpy()[np.unique(edges)],
+                           frame['annais'].to_numpy(), side='right')
+    return [rows for _, rows in frame.groupby(part, sort=True)]
+
+
+# function(frame, *args) on the whole frame, or on its year parts in a
+# pool of processes, concatenated in year order. function must give the
+# rows of each year from the rows of that year only.
+def by_year(function, frame, *args, engine=None, workers=None):
+    engine = engine or ENGINE
+    workers = workers or WORKERS
+    if engine not in ENGINES:
+        raise ValueError(f'Unknown aggregation engine: {engine}')
+    if engine == 'pandas' or workers < 2 or len(frame) < MIN_PARALLEL_ROWS:
+        return function(frame, *args)
+
+    parts = year_parts(frame, workers)
+    with ProcessPoolExecutor(workers) as pool:
+        results = list(pool.map(function, parts, *[[arg] * len(parts)
+                                                    for arg in args]))
+    return pd.concat(results, ignore_index=True)
+
+
+if __name__ == '__main__':
+    import time
+
+    import names_engine
+    from names_cubes import CUBE_LEVELS, aggregate
+    from names_data import clean_names, load_names
+    from names_index import top_k
+
+    # Time the processes whatever the size of the file
+    names_engine.MIN_PARALLEL_ROWS = 0
+
+    names = clean_names(load_names())
+    print(f'{len(names)} rows, {os.cpu_count()} cpus')
+
+    def timed(function, *args, **kwargs):
+        start = time.perf_counter()
+        result = function(*args, **kwargs)
+        return result, time.perf_counter() - start
+
+    reference = {}
+    for workers in sorted({1, 2, 4, os.cpu_count()}):
+        engine = 'pandas' if workers == 1 else 'processes'
+        cube, cube_seconds = timed(aggregate, names, CUBE_LEVELS['department'],
+                                   engine=engine, workers=workers)
+        top, top_seconds = timed(top_k, names, ['annais', 'sexe'], 20,
+                                 engine=engine, workers=workers)
+        if workers == 1:
+            reference = {'cube': (cube, cube_seconds),
+                         'top': (top, top_seconds)}
+        else:
+            assert cube.equals(reference['cube'][0])
+            assert top.equals(reference['top'][0])
+        print(f'{workers} process(es): department cube {cube_seconds:.2f} s '
+              f'(x{reference["cube"][1] / cube_seconds:.1f}), '
+              f'top 20 of each year {top_seconds:.2f} s '
+              f'(x{reference["top"][1] / top_seconds:.1f})')
@@ -0,0 +1,103 @@
+# Pre-baked department and region geometries for the density map
+#
+# Build them offline with: python3 names_geo.py
+
+import os
+
+import geopandas as gpd
+import numpy as np
+import shapely
+from shapely.ops import linemerge
+
+from names_data import CACHE_DIR, DATA_DIR, REGIONS_CSV, load_regions
+
+GEO_SOURCE = os.path.join(DATA_DIR, 'departements-avec-outre-mer.geojson')
+
+# Simplification tolerance of each precision level, in degrees
+PRECISIONS = {'full': 0, 'high': 0.001, 'medium': 0.005, 'low': 0.01}
+GRANULARITIES = ['department', 'region']
+
+
+def geo_path(granularity, precision):
+    return os.path.join(CACHE_DIR, f'geo_{granularity}_{precision}.geojson')
+
+
+# Simplify the borders shared by several polygons once, so that
+# neighbours stay glued together (no gap nor overlap between them)
+def simplify_shared(geometries, tolerance):
+    geometries = np.asarray(geometries)
+    if tolerance == 0:
+        return geometries
+
+    # Split the borders into lines between the points where 3 polygons meet
+    borders = linemerge(shapely.union_all(shapely.boundary(geometries)))
+    lines = shapely.get_parts(borders)
+    lines = shapely.simplify(lines, tolerance, preserve_topology=True)
+
+    # Rebuild the faces of the simplified borders and give each one back to
+    # the polygon it lies in (faces in no polygon are holes of the source)
+    faces = shapely.get_parts(shapely.polygonize(
+        shapely.get_parts(shapely.union_all(lines))))
+    points, owners = shapely.STRtree(geometries).query(
+        shapely.point_on_surface(faces), predicate='within')
+
+    simplified = []
+    for i, geometry in enumerate(geometries):
+        owned = faces[points[owners == i]]
+        if len(owned):
+            simplified.append(shapely.union_all(owned))
+        else:
+            simplified.append(shapely.simplify(
+                geometry, tolerance, preserve_topology=True))
+    return np.array(simplified)
+
+
+def build_geometries(source=GEO_SOURCE, regions_path=REGIONS_CSV):
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    departments = gpd.read_file(source)
+    regions = load_regions(regions_path).set_index('num_dep')['region_name']
+    departments['region_name'] = departments['code'].map(regions)
+
+    for precision, tolerance in PRECISIONS.items():
+        simplified = departments.set_geometry(
+            simplify_shared(departments.geometry, tolerance),
+            crs=departments.crs)
+        regions_geo = simplified[['region_name', 'geometry']].dissolve(
+            by='region_name').reset_index()
+
+        for granularity, geo in [('department', simplified),
+                                 ('region', regions_geo)]:
+            path = geo_path(granularity, precision)
+            if os.path.exists(path):
+                os.remove(path)
+            geo.to_file(path, driver='GeoJSON', COORDINATE_PRECISION=5)
+
+
+def geometries_are_fresh(source=GEO_SOURCE, regions_path=REGIONS_CSV):
+    paths = [geo_path(granularity, precision)
+             for granularity in GRANULARITIES for precision in PRECISIONS]
+    if not all(os.path.exists(path) for path in paths):
+        return False
+    built = min(os.path.getmtime(path) for path in paths)
+    return built >= max(os.path.getmtime(source),
+                        os.path.getmtime(regions_path))
+
+
+# Department ('code', 'nom', 'region_name') or region ('region_name')
+# polygons at one of the PRECISIONS
+def load_geometries(granularity='region', precision='medium',
+                    source=GEO_SOURCE, regions_path=REGIONS_CSV):
+    if not geometries_are_fresh(source, regions_path):
+        build_geometries(source, regions_path)
+    return gpd.read_file(geo_path(granularity, precision))
+
+
+if __name__ == '__main__':
+    build_geometries()
+    for granularity in GRANULARITIES:
+        for precision in PRECISIONS:
+            path = geo_path(granularity, precision)
+            geo = gpd.read_file(path)
+            print(f'{granularity} {precision}: {len(geo)} polygons, '
+                  f'{shapely.get_num_coordinates(geo.geometry).sum()} points, '
+                  f'{os.path.getsize(path) / 1024:.0f} KB')
@@ -0,0 +1,407 @@
+# Indexes over the cubes answering the period queries of the apps without
+# going back to the rows
+
+import numpy as np
+import pandas as pd
+
+from names_data import region_codes
+from names_engine import by_year
+
+
+class PrefixSums:
+    # Counts cumulated over the years for each (area, name, sex) series: the
+    # total of any period is the difference of two columns
+    #
+    # The series can be placed in the keys of a larger index (the keys of
+    # the summary of the cube), so that the indexes of several partitions
+    # of the years add up (combined_totals)
+
+    def __init__(self, cube, by=(), keys=None):
+        self.by = list(by)
+        columns = self.by + ['preusuel', 'sexe']
+        self.first_year = int(cube['annais'].min())
+        n_years = int(cube['annais'].max()) - self.first_year + 1
+
+        groups = cube.groupby(columns, observed=True)
+        rows = groups.ngroup().to_numpy()
+        own_keys = groups.size().reset_index()[columns]
+        if keys is None:
+            self.keys = own_keys
+            self.positions = np.arange(len(own_keys))
+        else:
+            self.keys = keys
+            self.positions = np.searchsorted(key_numbers(keys),
+                                             key_numbers(own_keys, keys))
+
+        # Column 0 is the empty sum before the first year
+        counts = np.zeros((len(own_keys), n_years + 1), dtype='int32')
+        counts[rows, cube['annais'].to_numpy() - self.first_year + 1] = \
+            cube['nombre'].to_numpy()
+        self.cumsum = np.cumsum(counts, axis=1, dtype='int32')
+
+        # Keys of each area, the keys being sorted by area first
+        self.areas = {}
+        if self.by:
+            area = self.keys[self.by[0]]
+            codes = area.cat.codes.to_numpy()
+            starts = np.flatnonzero(np.r_[True, codes[1:] != codes[:-1]])
+            ends = np.r_[starts[1:], len(codes)]
+            self.areas = {area.cat.categories[codes[s]]: slice(s, e)
+                          for s, e in zip(starts, ends)}
+
+    @property
+    def nbytes(self):
+        return self.cumsum.nbytes + self.positions.nbytes
+
+    # Add the totals of [start_year, end_year] to out, the totals of the
+    # keys rows (a slice of the keys)
+    def add_totals(self, out, start_year, end_year, rows):
+        last = self.cumsum.shape[1] - 1
+        start = min(max(start_year - self.first_year, 0), last)
+        end = min(max(end_year - self.first_year + 1, 0), last)
+        first, stop = np.searchsorted(self.positions, [rows.start, rows.stop])
+        out[self.positions[first:stop] - rows.start] += \
+            self.cumsum[first:stop, end] - self.cumsum[first:stop, start]
+
+    # Total per name and sex over [start_year, end_year], for one area if
+    # given, without the names absent from the period
+    def totals(self, start_year, end_year, area=None):
+        return combined_totals([self], start_year, end_year, area)
+
+
+# Codes of (area, name, sex) keys as single numbers, increasing in the
+# order of the reference keys (sorted, with the same columns)
+def key_numbers(keys, reference=None):
+    reference = keys if reference is None else reference
+    numbers = np.zeros(len(keys), dtype='int64')
+    for column in keys.columns:
+        if isinstance(reference[column].dtype, pd.CategoricalDtype):
+            categories = reference[column].cat.categories
+            codes = categories.get_indexer(keys[column].cat.categories)[
+                keys[column].cat.codes.to_numpy()]
+            size = len(categories)
+        else:
+            codes = keys[column].to_numpy().astype('int64')
+            size = int(reference[column].max()) + 1
+        numbers = numbers * size + codes
+    return numbers
+
+
+# Totals of PrefixSums over the same keys (one per partition of the years)
+# over [start_year, end_year], for one area if given, like the totals of
+# one index over all their years
+def combined_totals(indexes, start_year, end_year, area=None):
+    keys = indexes[0].keys
+    rows = slice(0, len(keys))
+    if area is not None:
+        rows = indexes[0].areas.get(area, slice(0, 0))
+    nombre = np.zeros(rows.stop - rows.start, dtype='int64')
+    for index in indexes:
+        index.add_totals(nombre, start_year, end_year, rows)
+
+    totals = keys.iloc[rows].assign(nombre=nombre)
+    if area is not None:
+        totals = totals.drop(columns=indexes[0].by)
+    return totals[totals['nombre'] > 0].reset_index(drop=True)
+
+
+class YearlyRanks:
+    # Rank of each name (both sexes together) in each year, as a dense
+    # year x name matrix, 0 when the name isn't given that year
+
+    def __init__(self, cube):
+        yearly = cube.groupby(['annais', 'preusuel'], observed=True)[
+            'nombre'].sum().reset_index()
+        yearly['rank'] = yearly.groupby('annais')['nombre'].rank(
+            method='first', ascending=False)
+
+        self.first_year = int(cube['annais'].min())
+        n_years = int(cube['annais'].max()) - self.first_year + 1
+        self.names = pd.Index(cube['preusuel'].cat.categories)
+
+        self.ranks = np.zeros((n_years, len(self.names)), dtype='int32')
+        self.ranks[yearly['annais'].to_numpy() - self.first_year,
+                   yearly['preusuel'].cat.codes.to_numpy()] = yearly['rank']
+
+    @property
+    def nbytes(self):
+        return self.ranks.nbytes
+
+    # Yearly ranks of a few names over [start_year, end_year], like the
+    # rows of the full rank table for these names
+    def series(self, names, start_year, end_year):
+        codes = self.names.get_indexer(names)
+        codes = np.sort(codes[codes >= 0])
+        start = max(start_year - self.first_year, 0)
+        end = max(end_year - self.first_year + 1, 0)
+
+        block = self.ranks[start:end, codes]
+        years, columns = np.nonzero(block)
+        return pd.DataFrame({
+            'annais': years + self.first_year + start,
+            'preusuel': self.names[codes[columns]],
+            'rank': block[years, columns],
+        })
+
+
+class AreaShares:
+    # Births of each name by year and department, stored name by name, and
+    # births of all the names by year and department cumulated over the
+    # years: the share of a name in each department or region over any
+    # period is one division of two vectors
+    #
+    # With the departments of the whole cube given, the vectors of the
+    # indexes of several partitions of the years add up (combined_density)
+
+    def __init__(self, cube, regions, departments=None):
+        self.first_year = int(cube['annais'].min())
+        n_years = int(cube['annais'].max()) - self.first_year + 1
+        self.names = pd.Index(cube['preusuel'].cat.categories)
+        if departments is None:
+            departments = cube['dpt'].cat.categories
+        self.departments = pd.Index(departments)
+
+        # Rows of name i are offsets[i]:offsets[i + 1]
+        codes = cube['preusuel'].cat.codes.to_numpy()
+        order = np.argsort(codes, kind='stable')
+        self.offsets = np.searchsorted(
+            codes[order], np.arange(len(self.names) + 1))
+        self.years = (cube['annais'].to_numpy()[order]
+                      - self.first_year).astype('int16')
+        self.dpts = self.departments.get_indexer(cube['dpt'].cat.categories)[
+            cube['dpt'].cat.codes.to_numpy()[order]].astype('int16')
+        self.counts = cube['nombre'].to_numpy()[order]
+
+        totals = np.zeros((n_years + 1, len(self.departments)), dtype='int64')
+        np.add.at(totals, (self.years + 1, self.dpts), self.counts)
+        self.totals = np.cumsum(totals, axis=0)
+
+        # Region of each department, -1 if it has none
+        self.regions, self.region_codes = region_codes(
+            self.departments, regions)
+
+    @property
+    def nbytes(self):
+        return (self.years.nbytes + self.dpts.nbytes + self.counts.nbytes
+                + self.totals.nbytes + self.offsets.nbytes)
+
+    # Births of the name (none if None) and of all the names by department
+    # over [start_year, end_year]
+    def births(self, name, start_year, end_year):
+        last = self.totals.shape[0] - 1
+        start = min(max(start_year - self.first_year, 0), last)
+        end = min(max(end_year - self.first_year + 1, 0), last)
+
+        named = np.zeros(len(self.departments))
+        if name is not None and name in self.names:
+            i = self.names.get_loc(name)
+            rows = slice(self.offsets[i], self.offsets[i + 1])
+            years = self.years[rows]
+            keep = (years >= start) & (years < end)
+            named = np.bincount(self.dpts[rows][keep],
+                                weights=self.counts[rows][keep],
+                                minlength=len(self.departments))
+        return named, self.totals[end] - self.totals[start]
+
+    # Sum of the department vectors by region
+    def by_region(self, values):
+        valid = self.region_codes >= 0
+        return np.bincount(self.region_codes[valid], weights=values[valid],
+                           minlength=len(self.regions))
+
+    # Births of the name, of all the names and their ratio ('density') over
+    # [start_year, end_year], for the departments ('dpt') or the regions
+    # ('region_name') where the name is given
+    def density(self, name, start_year, end_year, granularity='region'):
+        return combined_density([self], name, start_year, end_year,
+                                granularity)
+
+
+# Density of AreaShares over the same departments (one per partition of
+# the years), like the density of one index over all their years
+def combined_density(indexes, name, start_year, end_year,
+                     granularity='region'):
+    births = [index.births(name, start_year, end_year) for index in indexes]
+    named = sum(named for named, _ in births)
+    totals = sum(totals for _, totals in births)
+
+    if granularity == 'region':
+        named, totals = indexes[0].by_region(named), \
+            indexes[0].by_region(totals)
+        areas = pd.Series(indexes[0].regions, name='region_name')
+    else:
+        areas = pd.Series(indexes[0].departments, name='dpt')
+
+    density = pd.DataFrame({
+        areas.name: areas,
+        'nombre_name': named.astype('int64'),
+        'nombre_total': totals.astype('int64'),
+    })
+    density = density[density['nombre_name'] > 0].reset_index(drop=True)
+    density['density'] = density['nombre_name'] / density['nombre_total']
+    return density
+
+
+# Regions with births over [start_year, end_year], from AreaShares over the
+# same departments
+def combined_regions(indexes, start_year, end_year):
+    totals = sum(index.births(None, start_year, end_year)[1]
+                 for index in indexes)
+    births = indexes[0].by_region(totals)
+    return list(indexes[0].regions[births > 0])
+
+
+class SexShares:
+    # Male and female births of the names given to both sexes, as year x
+    # name matrices cumulated over the years, with the sums of a least
+    # squares line of the yearly male share weighted by the births: the
+    # male share, its drift and the crossovers of any period come from two
+    # rows of each matrix
+
+    def __init__(self, cube):
+        self.first_year = int(cube['annais'].min())
+        n_years = int(cube['annais'].max()) - self.first_year + 1
+
+        # Only the names with births of both sexes over all the years
+        sexes = cube.groupby('preusuel', observed=True)['sexe'].nunique()
+        cube = cube[cube['preusuel'].isin(sexes.index[sexes == 2])]
+        codes = cube['preusuel'].cat.remove_unused_categories()
+        self.names = pd.Index(codes.cat.categories)
+
+        males = np.zeros((n_years, len(self.names)))
+        females = np.zeros((n_years, len(self.names)))
+        years = cube['annais'].to_numpy() - self.first_year
+        is_male = cube['sexe'].to_numpy() == 1
+        np.add.at(males, (years[is_male], codes.cat.codes.to_numpy()[is_male]),
+                  cube['nombre'].to_numpy()[is_male])
+        np.add.at(females,
+                  (years[~is_male], codes.cat.codes.to_numpy()[~is_male]),
+                  cube['nombre'].to_numpy()[~is_male])
+
+        # Weighted sums of the line share = a + b * year, the weight of a
+        # year being its births (so the weighted shares are the male births)
+        births = males + females
+        t = np.arange(n_years)[:, None]
+        self.sums = {key: np.cumsum(np.vstack([np.zeros(len(self.names)),
+                                               values]), axis=0)
+                     for key, values in {
+                         'males': males, 'births': births,
+                         'males_t': males * t, 'births_t': births * t,
+                         'births_tt': births * t * t}.items()}
+
+        # Crossovers: years where the majority sex differs from the one of
+        # the previous year with a majority, and latest one up to each year
+        majority = pd.DataFrame(np.sign(males - females)).replace(0, np.nan)
+        previous = majority.ffill().shift(1)
+        crossed = (majority.notna() & previous.notna()
+                   & (majority != previous)).to_numpy()
+        self.crossovers = np.cumsum(
+            np.vstack([np.zeros(len(self.names), dtype='int16'), crossed]),
+            axis=0, dtype='int16')
+        self.last_crossover = pd.DataFrame(
+            np.where(crossed, t + self.first_year, np.nan)).ffill().fillna(
+            0).to_numpy().astype('int16')
+        # First year with a majority from each year on (n_years if none): a
+        # period only counts the crossovers after its first majority, not
+        # the one measured against the years before it
+        self.next_majority = np.vstack([
+            pd.DataFrame(np.where(majority.notna(), t, np.nan)).bfill()
+            .fillna(n_years).to_numpy(),
+            np.full((1, len(self.names)), n_years)]).astype('int16')
+
+    @property
+    def nbytes(self):
+        return (sum(values.nbytes for values in self.sums.values())
+                + self.crossovers.nbytes + self.last_crossover.nbytes
+                + self.next_majority.nbytes)
+
+    # Per name given to both sexes over [start_year, end_year]: births, male
+    # share, drift (change of the male share along the fitted line, from -1
+    # to 1), number of crossovers and year of the last one (0 if none)
+    def period(self, start_year, end_year):
+        last = len(self.crossovers) - 1
+        start = min(max(start_year - self.first_year, 0), last)
+        end = min(max(end_year - self.first_year + 1, 0), last)
+        sums = {key: values[end] - values[start]
+                for key, values in self.sums.items()}
+
+        given = (sums['males'] > 0) & (sums['males'] < sums['births'])
+        sums = {key: values[given] for key, values in sums.items()}
+        with np.errstate(divide='ignore', invalid='ignore'):
+            slope = ((sums['births'] * sums['males_t']
+                      - sums['births_t'] * sums['males'])
+                     / (sums['births'] * sums['births_tt']
+                        - sums['births_t'] ** 2))
+        slope = np.nan_to_num(slope, nan=0, posinf=0, neginf=0)
+
+        # Crossovers from the year after the first majority of the period
+        first = np.minimum(self.next_majority[start, given] + 1, end)
+        last_crossover = self.last_crossover[end - 1, given] if end else 0
+        return pd.DataFrame({
+            'preusuel': self.names[given],
+            'nombre': sums['births'].astype('int64'),
+            'male_share': sums['males'] / sums['births'],
+            'drift': np.clip(slope * max(end - start - 1, 0), -1, 1),
+            'crossovers': (self.crossovers[end, given]
+                           - self.crossovers[first, given]),
+            'last_crossover': np.where(
+                last_crossover >= first + self.first_year, last_crossover, 0),
+        })
+
+    # Yearly births and male share of a few names over [start_year,
+    # end_year], the years without births left out
+    def series(self, names, start_year, end_year):
+        codes = self.names.get_indexer(names)
+        codes = np.sort(codes[codes >= 0])
+        last = len(self.crossovers) - 1
+        start = min(max(start_year - self.first_year, 0), last)
+        end = min(max(end_year - self.first_year + 1, 0), last)
+
+        males, births = [np.diff(self.sums[key][start:end + 1, codes], axis=0)
+                         for key in ('males', 'births')]
+        years, columns = np.nonzero(births)
+        return pd.DataFrame({
+            'annais': years + self.first_year + start,
+            'preusuel': self.names[codes[columns]],
+            'nombre': births[years, columns].astype('int64'),
+            'male_share': males[years, columns] / births[years, columns],
+        })
+
+
+# Same rows and order as groupby(by).apply(lambda x: x.nlargest(k, column))
+# .reset_index(drop=True), with one sort instead of a call per group. The
+# years are split over processes with the 'processes' engine when by starts
+# with 'annais'.
+def top_k(frame, by, k, column='nombre', engine=None, workers=None):
+    by = list(by)
+    if by[0] == 'annais':
+        return by_year(top_k_rows, frame, by, k, column,
+                       engine=engine, workers=workers)
+    return top_k_rows(frame, by, k, column)
+
+
+def top_k_rows(frame, by, k, column):
+    ordered = frame.sort_values(
+        by + [column], ascending=[True] * len(by) + [False], kind='stable')
+    ranks = ordered.groupby(by, observed=True, sort=False).cumcount()
+    return ordered[ranks.to_numpy() < k].reset_index(drop=True)
+
+
+if __name__ == '__main__':
+    import timeit
+
+    from names_cubes import load_cube
+
+    cube = load_cube('national')[['annais', 'sexe', 'preusuel', 'nombre']]
+
+    def with_apply():
+        return cube.groupby(['annais', 'sexe']).apply(
+            lambda x: x.nlargest(20, 'nombre')).reset_index(drop=True)
+
+    def with_top_k():
+        return top_k(cube, ['annais', 'sexe'], 20)
+
+    assert with_apply().equals(with_top_k())
+    for function in (with_apply, with_top_k):
+        seconds = min(timeit.repeat(function, number=1, repeat=5))
+        print(f'{function.__name__}: {seconds * 1000:.1f} ms')
@@ -0,0 +1,246 @@
+# Chart data of the three visualisations, as functions of the selection
+# only (the datasets come from the shared store), cached by argument
+#
+# A period is a (start_year, end_year) tuple, a sex a key of SEX_LABELS;
+# the returned frames label the sexes with SEX_LABELS.
+
+from importlib import import_module
+
+import pandas as pd
+
+from names_cache import (BACKEND, cached_query, get_area_shares,
+                         get_cube, get_cube_bounds, get_geometries,
+                         get_name_index, get_prefix_sums, get_region_sums,
+                         get_sex_shares, get_trends, get_yearly_ranks)
+from names_data import SEX_LABELS
+from names_index import (combined_density, combined_regions, combined_totals,
+                         top_k)
+from names_search import MAX_RESULTS
+
+# names_duckdb or names_tensor, with the same functions
+if BACKEND != 'pandas':
+    backend = import_module('names_' + BACKEND)
+
+
+def label_sexes(frame):
+    return frame.assign(sexe=frame['sexe'].map(SEX_LABELS))
+
+
+@cached_query
+def year_bounds():
+    if BACKEND != 'pandas':
+        return backend.year_bounds()
+    return get_cube_bounds()
+
+
+# Best matches of a name search, cached by query: the close matches of a
+# typo scan every name
+@cached_query
+def search_names(query, limit=MAX_RESULTS):
+    return get_name_index().search(query, limit)
+
+
+def period_rows(cube, period):
+    start_year, end_year = period
+    return cube[(cube['annais'] >= start_year) & (cube['annais'] <= end_year)]
+
+
+# Births per name and sex over the period, in France or in a region
+@cached_query
+def name_totals(period, region=None):
+    if BACKEND != 'pandas':
+        return backend.name_totals(period, region)
+    if region is None:
+        return get_prefix_sums('national').totals(*period)
+    return combined_totals(get_region_sums(period), *period, area=region)
+
+
+# The k names of a sex with the most births over the period
+@cached_query
+def top_names(period, sex, k, region=None):
+    if BACKEND != 'pandas':
+        return label_sexes(backend.top_names(period, sex, k, region))
+    totals = name_totals(period, region)
+    return label_sexes(totals[totals['sexe'] == sex].nlargest(k, 'nombre'))
+
+
+# Regions with births over the period
+@cached_query
+def period_regions(period):
+    if BACKEND != 'pandas':
+        return backend.period_regions(period)
+    return combined_regions(get_area_shares(period), *period)
+
+
+# Yearly rank of the names (tuple) over the period
+@cached_query
+def rank_series(names, period):
+    if BACKEND != 'pandas':
+        return backend.rank_series(names, period)
+    return get_yearly_ranks().series(list(names), *period)
+
+
+# Last ranked year of each name of rank_series, to label the end of its
+# curve
+@cached_query
+def rank_ends(names, period):
+    series = rank_series(names, period)
+    return series.loc[series.groupby('preusuel')['annais'].idxmax()]
+
+
+# Births of the name, of all names and their ratio ('density') over the
+# period, per region or department ('region_name' or 'dpt' column)
+@cached_query
+def region_density(name, period, granularity='region'):
+    if BACKEND != 'pandas':
+        return backend.region_density(name, period, granularity)
+    return combined_density(get_area_shares(period), name, *period,
+                            granularity)
+
+
+# Region or department polygons (simplified once, see names_geo.py) with
+# the density of the name, an 'area_name' and a 'tooltip' for the map
+@cached_query
+def density_areas(name, period, granularity='region'):
+    density_data = region_density(name, period, granularity)
+    areas_geo = get_geometries(granularity, 'medium')
+
+    # Merge density data with the GeoDataFrame
+    if granularity == 'region':
+        areas_geo = areas_geo.merge(
+            density_data[['region_name', 'density']], on='region_name', how='left')
+        areas_geo['area_name'] = areas_geo['region_name']
+    else:
+        areas_geo = areas_geo.merge(
+            density_data[['dpt', 'density']], left_on='code', right_on='dpt', how='left')
+        areas_geo['area_name'] = areas_geo['nom'] + \
+            ' (' + areas_geo['code'] + ')'
+    areas_geo['density'] = areas_geo['density'].fillna(0)
+
+    # Tooltip of each area
+    areas_geo['tooltip'] = [
+        f"<strong>{area}</strong><br>Densité du prénom {name}: {density:.4f}"
+        for area, density in zip(areas_geo['area_name'], areas_geo['density'])]
+    return areas_geo
+
+
+# The k names of each year and sex with the most births, in the process:
+# the apps and the export workers never fork a pool of processes
+@cached_query
+def top_each_year(period, k):
+    if BACKEND != 'pandas':
+        return label_sexes(backend.top_each_year(period, k))
+    rows = period_rows(get_cube('national'), period)
+    return label_sexes(top_k(
+        rows[['annais', 'sexe', 'preusuel', 'nombre']], ['annais', 'sexe'], k,
+        engine='pandas'))
+
+
+# Number of years each name spent in the top k of its sex
+def years_in_top(period, k):
+    return top_each_year(period, k).groupby(
+        ['preusuel', 'sexe'], observed=True).size().reset_index(name='count')
+
+
+# Per sex: average number of years a name of the top k stays there, and
+# number of distinct names given over the period
+@cached_query
+def presence_metrics(period, k):
+    avg_presence = years_in_top(period, k)
+    avg_presence = avg_presence.groupby('sexe')['count'].mean().reset_index()
+    avg_presence.columns = ['sexe', 'avg_years_in_top_20']
+
+    if BACKEND != 'pandas':
+        name_counts = backend.name_counts(period)
+    else:
+        rows = period_rows(get_cube('national'), period)
+        name_counts = rows.groupby('sexe')['preusuel'].nunique().reset_index()
+        name_counts.columns = ['sexe', 'unique_names']
+    return pd.merge(avg_presence, label_sexes(name_counts), on='sexe')
+
+
+# The n names of each sex that spent the most years in the top k
+@cached_query
+def top_presence(period, k, n=10):
+    presence = years_in_top(period, k)
+    return presence.sort_values(
+        'count', ascending=False).groupby('sexe').head(n)
+
+
+# top_presence plus one 'MOYENNE <sex>' bar with the average of each sex
+@cached_query
+def presence_bars(period, k, n=10):
+    averages = presence_metrics(period, k)
+    averages = pd.DataFrame({
+        'preusuel': 'MOYENNE ' + averages['sexe'],
+        'sexe': averages['sexe'],
+        'count': averages['avg_years_in_top_20'],
+    })
+    return pd.concat([top_presence(period, k, n), averages])
+
+
+# For the names of top_presence: average year (over department rows),
+# total births and years in the top k, per sex
+@cached_query
+def presence_scatter(period, k, n=10):
+    names = top_presence(period, k, n)['preusuel'].unique()
+    if BACKEND != 'pandas':
+        rows = backend.national_rows(period, names)
+    else:
+        rows = period_rows(get_cube('national'), period)
+        rows = rows[rows['preusuel'].isin(names)]
+    rows = label_sexes(rows)
+    rows = rows.assign(
+        annais_dpt=rows['annais'] * rows['n_dpt'].astype('int64'))
+
+    scatter = rows.groupby(['preusuel', 'sexe'], observed=True)[
+        ['annais_dpt', 'n_dpt', 'nombre']].sum().reset_index()
+    scatter['annais'] = scatter['annais_dpt'] / scatter['n_dpt']
+    scatter = scatter[['preusuel', 'sexe', 'annais', 'nombre']]
+
+    presence = years_in_top(period, k).rename(
+        columns={'count': 'avg_years_in_top_20'})
+    return scatter.merge(presence, on=['preusuel', 'sexe'], how='left')
+
+
+# Names given to both sexes over the period with at least min_births births
+# and min_share of them to the less frequent sex: male share, drift of the
+# male share over the period, crossovers of the majority sex. The k names
+# whose male share moved the most first.
+@cached_query
+def epicene_names(period, k=20, min_births=1000, min_share=0.05):
+    names = get_sex_shares().period(*period)
+    names = names[(names['nombre'] >= min_births)
+                  & (names['male_share'] >= min_share)
+                  & (names['male_share'] <= 1 - min_share)]
+    order = names['drift'].abs().sort_values(ascending=False, kind='stable')
+    return names.loc[order.index[:k]].reset_index(drop=True)
+
+
+# Yearly births and male share of a few names
+@cached_query
+def sex_share_series(names, period):
+    return get_sex_shares().series(list(names), *period)
+
+
+# The k names with the strongest bursts (highest z-score) or declines
+# (lowest z-score), or with the most steady years, over the period: year,
+# score and share of the births of their strongest year (of highest share
+# for the steady names) and number of years of the kind
+@cached_query
+def trending_names(period, kind, k=20):
+    rows = period_rows(get_trends(), period)
+    rows = rows[rows['kind'] == kind]
+    if kind == 'steady':
+        rows = rows.sort_values('share', ascending=False, kind='stable')
+    else:
+        rows = rows.sort_values('score', ascending=kind == 'decline',
+                                kind='stable')
+
+    names = rows.groupby('preusuel', observed=True, sort=False).agg(
+        annais=('annais', 'first'), score=('score', 'first'),
+        share=('share', 'first'), years=('annais', 'size')).reset_index()
+    if kind == 'steady':
+        names = names.sort_values(['years', 'share'], ascending=False,
+                                  kind='stable')
+    return names.head(k).reset_index(drop=True)
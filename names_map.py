@@ -0,0 +1,130 @@
+# Density map of a name: one GeoJson layer for all the areas, coloured and
+# labelled from the properties of its features
+#
+# Compare with one layer per area: python3 names_map.py
+
+import os
+
+import branca
+import folium
+import numpy as np
+
+MAP_CENTER = [46.603354, 1.888334]
+
+# Default of the app option keeping the map in the browser
+# (NAMES_REUSE_MAP=1), see density_feature_group
+REUSE_BASE_MAP = os.environ.get('NAMES_REUSE_MAP', '0') == '1'
+
+
+def base_map():
+    m = folium.Map(location=MAP_CENTER, zoom_start=5, tiles=None)
+    folium.TileLayer('cartodbpositron').add_to(m)
+    return m
+
+
+def density_colormap(densities):
+    colormap = branca.colormap.linear.RdYlBu_09.scale(
+        densities.min(), densities.max())
+    colormap.caption = 'Densité du prénom'
+    return colormap
+
+
+def highlight_function(feature):
+    return {
+        'fillColor': 'yellow',
+        'color': 'yellow',
+        'weight': 1,
+        'fillOpacity': 0.6,
+    }
+
+
+# Single layer of the areas of geo, which needs a 'density' and a
+# 'tooltip' (html) column
+def density_layer(geo, colormap):
+    def style_function(feature):
+        return {
+            'fillColor': colormap(feature['properties']['density']),
+            'color': 'gray',
+            'weight': 1,
+            'fillOpacity': 0.6,
+        }
+
+    return folium.GeoJson(
+        data=geo[['density', 'tooltip', 'geometry']],
+        style_function=style_function,
+        highlight_function=highlight_function,
+        tooltip=folium.GeoJsonTooltip(fields=['tooltip'], labels=False),
+    )
+
+
+# Whole map, to display with folium_static
+def density_map(geo, colormap):
+    m = base_map()
+    density_layer(geo, colormap).add_to(m)
+    colormap.add_to(m)
+    return m
+
+
+# Layer to push to a map kept in the browser, with
+# st_folium(base_map(), feature_group_to_add=...): the map, its tiles, zoom
+# and position stay, the areas layer (polygons included) is sent again and
+# replaced when the name or the period change
+def density_feature_group(geo, colormap):
+    group = folium.FeatureGroup(name='density')
+    density_layer(geo, colormap).add_to(group)
+    return group
+
+
+# Legend of the colormap as html, for a map whose layers are updated
+# without the colormap control of density_map
+def density_legend(colormap, steps=10):
+    values = np.linspace(colormap.vmin, colormap.vmax, steps)
+    gradient = ', '.join(colormap.rgb_hex_str(value) for value in values)
+    return (f"<div style='font-size:12px;'>{colormap.caption}</div>"
+            f"<div style='width:300px; height:12px; "
+            f"background:linear-gradient(to right, {gradient});'></div>"
+            f"<div style='width:300px; display:flex; "
+            f"justify-content:space-between; font-size:12px;'>"
+            f"<span>{colormap.vmin:.4f}</span>"
+            f"<span>{colormap.vmax:.4f}</span></div>")
+
+
+if __name__ == '__main__':
+    import time
+
+    from names_geo import load_geometries
+
+    # Previous map: one GeoJson layer (style and tooltip) per area
+    def per_area_map(geo, colormap):
+        m = base_map()
+        for _, row in geo.iterrows():
+            feature = {
+                'type': 'Feature',
+                'properties': {'density': row['density']},
+                'geometry': row['geometry'].__geo_interface__
+            }
+            folium.GeoJson(
+                data=feature,
+                style_function=lambda feature: {
+                    'fillColor': colormap(feature['properties']['density']),
+                    'color': 'gray', 'weight': 1, 'fillOpacity': 0.6},
+                highlight_function=highlight_function,
+                tooltip=folium.Tooltip(row['tooltip']),
+            ).add_to(m)
+        colormap.add_to(m)
+        return m
+
+    for granularity in ['region', 'department']:
+        geo = load_geometries(granularity, 'medium')
+        geo['density'] = np.random.default_rng(0).random(len(geo)) / 100
+        geo['tooltip'] = [f'<strong>Zone {i}</strong><br>Densité: {d:.4f}'
+                          for i, d in enumerate(geo['density'])]
+        colormap = density_colormap(geo['density'])
+
+        for build in (per_area_map, density_map):
+            start = time.perf_counter()
+            html = build(geo, colormap).get_root().render()
+            seconds = time.perf_counter() - start
+            print(f'{granularity} {build.__name__}: {len(html) / 1024:.0f} KB'
+                  f' of html, {html.count("L.geoJson(")} layers,'
+                  f' built in {seconds * 1000:.0f} ms')
@@ -0,0 +1,63 @@
+# Server-side name search, so that the apps never send the full name list
+# to the browser
+
+import bisect
+import difflib
+import sys
+import unicodedata
+
+import numpy as np
+
+# Most matches returned for a query
+MAX_RESULTS = 20
+
+
+# Search key of a name: no accents, upper case, hyphens as spaces
+# ('Éloïse' and 'ELOISE' both give 'ELOISE')
+def normalize(name):
+    name = unicodedata.normalize('NFKD', str(name))
+    name = ''.join(c for c in name if not unicodedata.combining(c))
+    return ' '.join(name.upper().replace('-', ' ').split())
+
+
+class NameIndex:
+    # Normalized names sorted alphabetically: the names starting with a
+    # prefix are a contiguous range found by bisection
+
+    def __init__(self, cube):
+        popularity = cube.groupby('preusuel', observed=True)['nombre'].sum()
+        keys = [normalize(name) for name in popularity.index]
+        order = sorted(range(len(keys)), key=keys.__getitem__)
+
+        self.keys = [keys[i] for i in order]
+        self.names = popularity.index.to_numpy()[order]
+        self.popularity = popularity.to_numpy()[order]
+        self.most_popular = np.argsort(-self.popularity, kind='stable')
+
+    @property
+    def nbytes(self):
+        return (sum(sys.getsizeof(key) for key in self.keys)
+                + sum(sys.getsizeof(name) for name in self.names)
+                + self.popularity.nbytes + self.most_popular.nbytes)
+
+    # Most popular names starting with the query, or closest to it when
+    # none does (typos)
+    def search(self, query, limit=MAX_RESULTS):
+        query = normalize(query)
+        if not query:
+            return list(self.names[self.most_popular[:limit]])
+
+        start = bisect.bisect_left(self.keys, query)
+        end = bisect.bisect_left(self.keys, query + '\uffff')
+        if end > start:
+            matches = np.arange(start, end)
+            order = np.argsort(-self.popularity[matches], kind='stable')
+            return list(self.names[matches[order[:limit]]])
+
+        close = set(difflib.get_close_matches(
+            query, self.keys, n=limit, cutoff=0.75))
+        matches = np.array([i for key in close for i in range(
+            bisect.bisect_left(self.keys, key),
+            bisect.bisect_right(self.keys, key))], dtype='int64')
+        order = np.argsort(-self.popularity[matches], kind='stable')
+        return list(self.names[matches[order[:limit]]])
@@ -0,0 +1,352 @@
+# Memory-mapped backend of the chart data (NAMES_BACKEND=tensor): the
+# department cube as flat NumPy arrays in data/cache, opened with
+# mmap_mode='r' so that all the Streamlit processes of a machine share one
+# copy through the page cache
+#
+# The rows (year, sex, name, department, count) are sorted by year: a
+# period is a slice of them. The rows of a name are found through a
+# permutation sorted by name with CSR-like offsets. The queries are
+# bincounts over these views instead of frame filters.
+#
+# Build it offline with: python3 names_tensor.py
+
+import json
+import os
+import tempfile
+import threading
+
+import numpy as np
+import pandas as pd
+
+from names_cubes import cubes_are_fresh, cubes_signature, load_cube, \
+    update_cubes
+from names_data import CACHE_DIR, NAMES_CSV, REGIONS_CSV, file_lock, \
+    load_regions, region_codes, replace_directory
+
+ARRAYS = [
+    # Rows sorted by year, the rows of year i being
+    # year_offsets[i]:year_offsets[i + 1]
+    'annais', 'sexe', 'name', 'dpt', 'nombre', 'year_offsets',
+    # Rows of name i: name_rows[name_offsets[i]:name_offsets[i + 1]]
+    'name_rows', 'name_offsets',
+    # Births of all the names by department cumulated over the years
+    'totals',
+    # Sorted names and departments (the codes of the rows), region code of
+    # each department (-1 without region) and sorted region names
+    'names', 'departments', 'region_of', 'regions',
+]
+
+TENSOR = None
+TENSOR_LOCK = threading.Lock()
+
+
+def tensor_path(csv_path=NAMES_CSV):
+    base = os.path.splitext(os.path.basename(csv_path))[0]
+    return os.path.join(CACHE_DIR, f'{base}_tensor')
+
+
+def build_tensor(csv_path=NAMES_CSV, regions_path=REGIONS_CSV):
+    cube = load_cube('department', None, csv_path, regions_path)
+    first_year = int(cube['annais'].min())
+    last_year = int(cube['annais'].max())
+    years = cube['annais'].to_numpy() - first_year
+    names = cube['preusuel'].cat.codes.to_numpy().astype('int32')
+    dpts = cube['dpt'].cat.codes.to_numpy().astype('int16')
+    counts = cube['nombre'].to_numpy().astype('int32')
+    n_names = len(cube['preusuel'].cat.categories)
+    departments = cube['dpt'].cat.categories
+
+    name_rows = np.argsort(names, kind='stable').astype('int32')
+    totals = np.zeros((last_year - first_year + 2, len(departments)),
+                      dtype='int64')
+    np.add.at(totals, (years + 1, dpts), counts)
+    regions, region_of = region_codes(departments, load_regions(regions_path))
+
+    arrays = {
+        'annais': cube['annais'].to_numpy().astype('int16'),
+        'sexe': cube['sexe'].to_numpy().astype('int8'),
+        'name': names,
+        'dpt': dpts,
+        'nombre': counts,
+        'year_offsets': np.searchsorted(
+            years, np.arange(last_year - first_year + 2)),
+        'name_rows': name_rows,
+        'name_offsets': np.searchsorted(
+            names[name_rows], np.arange(n_names + 1)),
+        'totals': np.cumsum(totals, axis=0),
+        'names': np.array(cube['preusuel'].cat.categories, dtype=str),
+        'departments': np.array(departments, dtype=str),
+        'region_of': region_of.astype('int16'),
+        'regions': np.array(regions, dtype=str),
+    }
+
+    # Written in a directory of this process then swapped: the processes
+    # still mapping the previous files keep reading them until they reopen
+    # the new ones
+    path = tensor_path(csv_path)
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    partial = tempfile.mkdtemp(dir=CACHE_DIR,
+                               prefix='.' + os.path.basename(path) + '.')
+    os.chmod(partial, 0o755)
+    for name in ARRAYS:
+        np.save(os.path.join(partial, name + '.npy'), arrays[name])
+    meta = {'first_year': first_year, 'last_year': last_year,
+            'signature': cubes_signature(csv_path, regions_path)}
+    with open(os.path.join(partial, 'meta.json'), 'w') as f:
+        json.dump(meta, f)
+    replace_directory(partial, path)
+
+
+# Lock of the tensor files shared by the processes of the machine:
+# exclusive to build them, shared to open them
+def files_lock(shared=False, csv_path=NAMES_CSV):
+    return file_lock(tensor_path(csv_path), shared)
+
+
+def tensor_meta(csv_path=NAMES_CSV):
+    meta_path = os.path.join(tensor_path(csv_path), 'meta.json')
+    if not os.path.exists(meta_path):
+        return None
+    with open(meta_path) as f:
+        return json.load(f)
+
+
+# Arrays of the process, memory-mapped, built first (by one process) or
+# opened again when the sources changed
+def tensor():
+    global TENSOR
+    with TENSOR_LOCK:
+        if not cubes_are_fresh():
+            update_cubes(engine='pandas')
+        signature = cubes_signature()
+        meta = tensor_meta()
+        if meta is None or meta['signature'] != signature:
+            with files_lock():
+                # Built by another process while waiting for the lock
+                meta = tensor_meta()
+                if meta is None or meta['signature'] != signature:
+                    build_tensor()
+        if TENSOR is None or TENSOR['meta'] != tensor_meta():
+            with files_lock(shared=True):
+                meta = tensor_meta()
+                TENSOR = {name: np.load(os.path.join(tensor_path(),
+                                                     name + '.npy'),
+                                        mmap_mode='r')
+                          for name in ARRAYS}
+            TENSOR['meta'] = meta
+        return TENSOR
+
+
+# Rows of the period, as a slice of the rows sorted by year
+def year_rows(t, period):
+    first_year = t['meta']['first_year']
+    last = len(t['year_offsets']) - 1
+    start = min(max(period[0] - first_year, 0), last)
+    end = min(max(period[1] - first_year + 1, 0), last)
+    return slice(t['year_offsets'][start], t['year_offsets'][end])
+
+
+# Mask of the rows in the departments of a region
+def region_mask(t, rows, region):
+    code = np.searchsorted(t['regions'], region)
+    if code == len(t['regions']) or t['regions'][code] != region:
+        return np.zeros(rows.stop - rows.start, dtype=bool)
+    return t['region_of'][t['dpt'][rows]] == code
+
+
+# Codes of the known names among names, sorted
+def name_codes(t, names):
+    names = np.array(list(names), dtype=str)
+    codes = np.searchsorted(t['names'], names)
+    known = codes < len(t['names'])
+    known[known] = t['names'][codes[known]] == names[known]
+    return np.unique(codes[known])
+
+
+# Rows of the names over the period
+def name_rows(t, names, period):
+    rows = np.concatenate(
+        [np.array([], dtype='int32')]
+        + [t['name_rows'][t['name_offsets'][code]:t['name_offsets'][code + 1]]
+           for code in name_codes(t, names)])
+    years = t['annais'][rows]
+    return rows[(years >= period[0]) & (years <= period[1])]
+
+
+def year_bounds():
+    meta = tensor()['meta']
+    return meta['first_year'], meta['last_year']
+
+
+# Births per name and sex over the period, in France or in a region
+def name_totals(period, region=None):
+    t = tensor()
+    rows = year_rows(t, period)
+    keys = t['name'][rows] * 2 + t['sexe'][rows] - 1
+    weights = t['nombre'][rows]
+    if region is not None:
+        mask = region_mask(t, rows, region)
+        keys, weights = keys[mask], weights[mask]
+    counts = np.bincount(keys, weights=weights,
+                         minlength=2 * len(t['names'])).astype('int64')
+    present = np.flatnonzero(counts)
+    return pd.DataFrame({
+        'preusuel': t['names'][present // 2],
+        'sexe': present % 2 + 1,
+        'nombre': counts[present],
+    })
+
+
+# The k names of a sex with the most births over the period
+def top_names(period, sex, k, region=None):
+    t = tensor()
+    rows = year_rows(t, period)
+    mask = t['sexe'][rows] == sex
+    if region is not None:
+        mask &= region_mask(t, rows, region)
+    counts = np.bincount(t['name'][rows][mask],
+                         weights=t['nombre'][rows][mask],
+                         minlength=len(t['names'])).astype('int64')
+    present = np.flatnonzero(counts)
+    top = present[np.lexsort((present, -counts[present]))[:k]]
+    return pd.DataFrame({
+        'preusuel': t['names'][top],
+        'sexe': sex,
+        'nombre': counts[top],
+    })
+
+
+def period_regions(period):
+    t = tensor()
+    rows = year_rows(t, period)
+    births = np.bincount(t['dpt'][rows], weights=t['nombre'][rows],
+                         minlength=len(t['departments']))
+    codes = np.unique(t['region_of'][births > 0])
+    return list(t['regions'][codes[codes >= 0]])
+
+
+# Yearly rank of the names among all the names (both sexes together), ties
+# in alphabetical order
+def rank_series(names, period):
+    t = tensor()
+    codes = name_codes(t, names)
+    first_year, last_year = t['meta']['first_year'], t['meta']['last_year']
+
+    series = []
+    for year in range(max(period[0], first_year),
+                      min(period[1], last_year) + 1):
+        rows = year_rows(t, (year, year))
+        counts = np.bincount(t['name'][rows], weights=t['nombre'][rows],
+                             minlength=len(t['names']))
+        present = codes[counts[codes] > 0]
+        if not len(present):
+            continue
+        order = np.lexsort((np.arange(len(counts)), -counts))
+        rank = np.empty(len(counts), dtype='int64')
+        rank[order] = np.arange(1, len(counts) + 1)
+        series.append(pd.DataFrame({
+            'annais': year,
+            'preusuel': t['names'][present],
+            'rank': rank[present],
+        }))
+    if not series:
+        return pd.DataFrame({'annais': [], 'preusuel': [], 'rank': []})
+    return pd.concat(series, ignore_index=True)
+
+
+# Births of the name, of all names and their ratio over the period, per
+# region or department, where the name is given
+def region_density(name, period, granularity='region'):
+    t = tensor()
+    first_year = t['meta']['first_year']
+    last = len(t['totals']) - 1
+    start = min(max(period[0] - first_year, 0), last)
+    end = min(max(period[1] - first_year + 1, 0), last)
+
+    rows = name_rows(t, [name], period)
+    named = np.bincount(t['dpt'][rows], weights=t['nombre'][rows],
+                        minlength=len(t['departments']))
+    totals = t['totals'][end] - t['totals'][start]
+
+    if granularity == 'region':
+        valid = t['region_of'] >= 0
+        named, totals = [
+            np.bincount(t['region_of'][valid], weights=values[valid],
+                        minlength=len(t['regions']))
+            for values in (named, totals)]
+        areas = pd.Series(t['regions'], name='region_name')
+    else:
+        areas = pd.Series(t['departments'], name='dpt')
+
+    density = pd.DataFrame({
+        areas.name: areas,
+        'nombre_name': named.astype('int64'),
+        'nombre_total': totals.astype('int64'),
+    })
+    density = density[density['nombre_name'] > 0].reset_index(drop=True)
+    density['density'] = density['nombre_name'] / density['nombre_total']
+    return density
+
+
+# The k names of each year and sex with the most births
+def top_each_year(period, k):
+    t = tensor()
+    first_year, last_year = t['meta']['first_year'], t['meta']['last_year']
+    tops = []
+    for year in range(max(period[0], first_year),
+                      min(period[1], last_year) + 1):
+        rows = year_rows(t, (year, year))
+        for sex in (1, 2):
+            mask = t['sexe'][rows] == sex
+            counts = np.bincount(t['name'][rows][mask],
+                                 weights=t['nombre'][rows][mask],
+                                 minlength=len(t['names'])).astype('int64')
+            present = np.flatnonzero(counts)
+            top = present[np.lexsort((present, -counts[present]))[:k]]
+            tops.append(pd.DataFrame({
+                'annais': year,
+                'sexe': sex,
+                'preusuel': t['names'][top],
+                'nombre': counts[top],
+            }))
+    return pd.concat(tops, ignore_index=True)
+
+
+# Number of distinct names of each sex given over the period
+def name_counts(period):
+    t = tensor()
+    rows = year_rows(t, period)
+    counts = [len(np.unique(t['name'][rows][t['sexe'][rows] == sex]))
+              for sex in (1, 2)]
+    return pd.DataFrame({'sexe': [1, 2], 'unique_names': counts})
+
+
+# Rows of the national cube of a few names over the period
+def national_rows(period, names):
+    t = tensor()
+    rows = name_rows(t, names, period)
+    frame = pd.DataFrame({
+        'annais': t['annais'][rows],
+        'sexe': t['sexe'][rows],
+        'preusuel': t['names'][t['name'][rows]],
+        'nombre': t['nombre'][rows],
+    })
+    return frame.groupby(['annais', 'sexe', 'preusuel']).agg(
+        nombre=('nombre', 'sum'), n_dpt=('nombre', 'size')).reset_index()
+
+
+# Births of each name, for the name search
+def name_popularity():
+    t = tensor()
+    counts = np.bincount(t['name'], weights=t['nombre'],
+                         minlength=len(t['names'])).astype('int64')
+    return pd.DataFrame({'preusuel': t['names'], 'nombre': counts})
+
+
+if __name__ == '__main__':
+    with files_lock():
+        build_tensor()
+    sizes = {name: os.path.getsize(os.path.join(tensor_path(), name + '.npy'))
+             for name in ARRAYS}
+    print(f'{sum(sizes.values()) / 1024 ** 2:.1f} MB in {tensor_path()}, '
+          f'shared by the processes')
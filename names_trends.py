@@ -0,0 +1,154 @@
+# Bursts, declines and steady years of every name, detected at once on the
+# year x name matrix of the shares of the births and stored in data/cache
+#
+# Each year of a name is compared to its WINDOW_YEARS previous years by a
+# z-score of its share of the births of the year: 'burst' from Z_THRESHOLD,
+# 'decline' from -Z_THRESHOLD, 'steady' within STEADY_Z over a full
+# window. Only the names with at least MIN_SHARE of the births (during the
+# burst or steady year, before the decline) are kept.
+#
+# Built on the first run, or offline with: python3 names_trends.py
+
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from names_cubes import cubes_are_fresh, cubes_signature, load_cube, \
+    update_cubes, write_parquet
+from names_data import CACHE_DIR, NAMES_CSV, REGIONS_CSV, file_lock, \
+    write_json
+
+WINDOW_YEARS = 10
+# Fewest previous years to score a year
+MIN_WINDOW_YEARS = 5
+Z_THRESHOLD = 3
+STEADY_Z = 0.5
+MIN_SHARE = 1e-4
+# Smallest spread of a window, relative to its mean share: a name has to
+# move by 3 x 10% of its usual share to burst or decline
+MIN_RELATIVE_STD = 0.1
+
+TREND_KINDS = ['burst', 'decline', 'steady']
+
+
+def trends_path(csv_path=NAMES_CSV):
+    base = os.path.splitext(os.path.basename(csv_path))[0]
+    return os.path.join(CACHE_DIR, f'{base}_trends.parquet')
+
+
+def trends_meta_path(csv_path=NAMES_CSV):
+    base = os.path.splitext(os.path.basename(csv_path))[0]
+    return os.path.join(CACHE_DIR, f'{base}_trends.json')
+
+
+# Version of the sources and of the detection settings
+def trends_signature(csv_path=NAMES_CSV, regions_path=REGIONS_CSV):
+    return {'cubes': cubes_signature(csv_path, regions_path),
+            'settings': [WINDOW_YEARS, MIN_WINDOW_YEARS, Z_THRESHOLD,
+                         STEADY_Z, MIN_SHARE, MIN_RELATIVE_STD]}
+
+
+# Share of the births of each year (rows) for each name (columns), and
+# z-score of each year against the previous years of the name (NaN
+# without enough previous years)
+def trend_scores(cube):
+    first_year = int(cube['annais'].min())
+    n_years = int(cube['annais'].max()) - first_year + 1
+    codes = cube['preusuel'].cat.codes.to_numpy()
+    years = cube['annais'].to_numpy() - first_year
+
+    births = np.zeros((n_years, len(cube['preusuel'].cat.categories)))
+    np.add.at(births, (years, codes), cube['nombre'].to_numpy())
+    totals = births.sum(axis=1, keepdims=True)
+    shares = np.divide(births, totals, out=np.zeros_like(births),
+                       where=totals > 0)
+
+    # Mean and spread of the window before each year, from cumulated sums
+    sums = np.vstack([np.zeros((1, shares.shape[1])),
+                      np.cumsum(shares, axis=0)])
+    squares = np.vstack([np.zeros((1, shares.shape[1])),
+                         np.cumsum(shares ** 2, axis=0)])
+    ends = np.arange(n_years)
+    starts = np.maximum(ends - WINDOW_YEARS, 0)
+    window = (ends - starts)[:, None]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        means = (sums[ends] - sums[starts]) / window
+        spreads = np.sqrt(np.maximum(
+            (squares[ends] - squares[starts]) / window - means ** 2, 0))
+    spreads = np.maximum(spreads, np.maximum(MIN_RELATIVE_STD * means,
+                                             MIN_SHARE))
+    scores = (shares - means) / spreads
+    scores[window[:, 0] < MIN_WINDOW_YEARS] = np.nan
+    return first_year, shares, means, scores, window[:, 0]
+
+
+# One row per burst, decline or steady year of a name: year, name, kind,
+# z-score and share of the births of the year, sorted by year
+def detect_trends(cube):
+    first_year, shares, means, scores, window = trend_scores(cube)
+    with np.errstate(invalid='ignore'):
+        kinds = {
+            'burst': (scores >= Z_THRESHOLD) & (shares >= MIN_SHARE),
+            'decline': (scores <= -Z_THRESHOLD) & (means >= MIN_SHARE),
+            'steady': ((np.abs(scores) <= STEADY_Z) & (shares >= MIN_SHARE)
+                       & (window[:, None] == WINDOW_YEARS)),
+        }
+
+    names = cube['preusuel'].cat.categories
+    trends = []
+    for kind, found in kinds.items():
+        years, columns = np.nonzero(found)
+        trends.append(pd.DataFrame({
+            'annais': (years + first_year).astype('int16'),
+            'preusuel': pd.Categorical.from_codes(columns, names),
+            'kind': kind,
+            'score': scores[years, columns].astype('float32'),
+            'share': shares[years, columns].astype('float32'),
+        }))
+    trends = pd.concat(trends, ignore_index=True)
+    trends['kind'] = pd.Categorical(trends['kind'], TREND_KINDS)
+    return trends.sort_values(['annais', 'kind', 'preusuel'],
+                              ignore_index=True)
+
+
+def build_trends(csv_path=NAMES_CSV, regions_path=REGIONS_CSV):
+    trends = detect_trends(load_cube('national', None, csv_path,
+                                     regions_path))
+    write_parquet(trends, trends_path(csv_path))
+    write_json(trends_signature(csv_path, regions_path),
+               trends_meta_path(csv_path))
+    return trends
+
+
+def trends_are_fresh(csv_path=NAMES_CSV, regions_path=REGIONS_CSV):
+    if not os.path.exists(trends_path(csv_path)) \
+            or not os.path.exists(trends_meta_path(csv_path)):
+        return False
+    with open(trends_meta_path(csv_path)) as f:
+        meta = json.load(f)
+    return meta == trends_signature(csv_path, regions_path)
+
+
+# The trends of all the years, or of a period, built first if the sources
+# changed
+def load_trends(period=None, csv_path=NAMES_CSV, regions_path=REGIONS_CSV):
+    if not cubes_are_fresh(csv_path, regions_path):
+        update_cubes(csv_path, regions_path, engine='pandas')
+    if not trends_are_fresh(csv_path, regions_path):
+        with file_lock(trends_path(csv_path)):
+            # Built by another process while waiting for the lock
+            if not trends_are_fresh(csv_path, regions_path):
+                build_trends(csv_path, regions_path)
+    filters = None
+    if period is not None:
+        start_year, end_year = period
+        filters = [('annais', '>=', start_year), ('annais', '<=', end_year)]
+    return pd.read_parquet(trends_path(csv_path), filters=filters)
+
+
+if __name__ == '__main__':
+    trends = build_trends()
+    print(trends['kind'].value_counts().to_string())
+    print(f'{trends["preusuel"].nunique()} names, written to {trends_path()}')
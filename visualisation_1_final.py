@@ -1,33 +1,27 @@
 # Visualization 1
 
 import streamlit as st
-import altair as alt
-import pandas as pd
 import numpy as np
-
-alt.data_transformers.enable('json')
-
-# Load data
-names = pd.read_csv("data/dpt2020.csv", sep=";")
-names.drop(names[names.preusuel == '_PRENOMS_RARES'].index, inplace=True)
-names.drop(names[names.dpt == 'XX'].index, inplace=True)
+from names_charts import (MAX_LABELLED_NAMES, popularity_chart, top_20_chart,
+                          trend_chart)
+from names_lib import (rank_ends, rank_series, search_names, top_names,
+                       trending_names, year_bounds)
 
 # Streamlit app
 st.title('Visualisation 1 : Baby names')
 
-# Create a range of years from 1900 to 2020
-names['annais'] = names['annais'].astype(int)
-year_range = np.arange(1900, 2021, 1)
+# Create the range of years of the data
+first_year, last_year = year_bounds()
+year_range = np.arange(first_year, last_year + 1, 1)
 
 # Select the range using a slider
 st.markdown("<b><small>Sélectionner une période</small></b>",
             unsafe_allow_html=True)
 start_year, end_year = st.select_slider(
-    "Year Range Slider", options=year_range, value=(1900, 2020), label_visibility="collapsed"
+    "Year Range Slider", options=year_range, value=(first_year, last_year), label_visibility="collapsed"
 )
 
-filtered_names = names[(names['annais'] >= start_year)
-                       & (names['annais'] <= end_year)]
+period = (start_year, end_year)
 
 # Initialize session state for selected names
 if 'selected_names' not in st.session_state:
@@ -48,105 +42,26 @@ def remove_name():
         st.session_state.selected_names.remove(name_to_remove)
 
 
+# Function to add the names of the trend chart
+
+
+def add_trending_names(names):
+    for name in names:
+        if name not in st.session_state.selected_names:
+            st.session_state.selected_names.append(name)
+
+
+# Top 20 male and top 20 female names, summed for all regions and selected
+# years
+top_20_males = top_names(period, 1, 20).assign(gender='Male')
+top_20_females = top_names(period, 2, 20).assign(gender='Female')
+
 # Ensure filtered data is not empty
-if not filtered_names.empty:
-    # Sum the counts per name for all regions and selected years
-    aggregated_names = filtered_names.groupby(
-        ['preusuel', 'sexe']).agg({'nombre': 'sum'}).reset_index()
-
-    # Map gender to labels
-    aggregated_names['gender'] = aggregated_names['sexe'].map(
-        {1: 'Male', 2: 'Female'})
-
-    # Filter top 20 male and top 20 female names
-    top_20_males = aggregated_names[aggregated_names['sexe'] == 1].nlargest(
-        20, 'nombre')
-    top_20_females = aggregated_names[aggregated_names['sexe'] == 2].nlargest(
-        20, 'nombre')
-
-    # Invert the order for male names and set y-axis on the right
-    top_20_males['nombre'] = -top_20_males['nombre']
-
-    # Combine the datasets for males and females
-    top_combined_names = pd.concat([top_20_males, top_20_females])
-
-    # Create the top names chart for males
-    top_males_chart = alt.Chart(top_20_males).mark_bar().encode(
-        x=alt.X('nombre:Q', title='', axis=alt.Axis(labels=True, format='~s')),
-        y=alt.Y('preusuel:N', title='', sort=None, axis=alt.Axis(
-            orient='left', labels=False, ticks=False)),
-        color=alt.value('blue'),
-        tooltip=[alt.Tooltip('preusuel:N', title='prenom'), alt.Tooltip(
-            'nombre:Q', title='nombre'), alt.Tooltip('gender:N', title='sexe')]
-    ).properties(
-        width=400,
-        height=400
-    )
-
-    top_males_text = top_males_chart.mark_text(
-        align='right',
-        baseline='middle',
-        dx=-3
-    ).encode(
-        text='preusuel:N',
-        color=alt.value('white')
-    )
-
-    top_males_numbers = top_males_chart.mark_text(
-        align='left',
-        baseline='middle',
-        dx=3,
-        color='blue'
-    ).encode(
-        text='nombre:Q'
-    )
-
-    # Create the top names chart for females
-    top_females_chart = alt.Chart(top_20_females).mark_bar().encode(
-        x=alt.X('nombre:Q', title='', axis=alt.Axis(labels=True, format='~s')),
-        y=alt.Y('preusuel:N', title='', sort=None, axis=alt.Axis(
-            orient='right', labels=False, ticks=False)),
-        color=alt.value('pink'),
-        tooltip=[alt.Tooltip('preusuel:N', title='prenom'), alt.Tooltip(
-            'nombre:Q', title='nombre'), alt.Tooltip('gender:N', title='sexe')]
-    ).properties(
-        width=400,
-        height=400
-    )
-
-    top_females_text = top_females_chart.mark_text(
-        align='left',
-        baseline='middle',
-        dx=3
-    ).encode(
-        text='preusuel:N',
-        color=alt.value('white')
-    )
-
-    top_females_numbers = top_females_chart.mark_text(
-        align='right',
-        baseline='middle',
-        dx=-3,
-        color='pink'
-    ).encode(
-        text='nombre:Q'
-    )
-
-    top_combined_chart = alt.hconcat(
-        (top_males_chart + top_males_text + top_males_numbers),
-        (top_females_chart + top_females_text + top_females_numbers)
-    ).resolve_scale(
-        x='independent'
-    ).properties(
-        title='Top 20 des prénoms masculins et féminins les plus populaires'
-    ).configure_axis(
-        labelFontSize=12,
-        titleFontSize=14
-    )
+if not (top_20_males.empty and top_20_females.empty):
+    top_combined_chart = top_20_chart(top_20_males, top_20_females)
 
     # Display the top combined chart
-    st.altair_chart(top_combined_chart.configure_title(
-        fontSize=24, anchor='start'), use_container_width=True)
+    st.altair_chart(top_combined_chart, use_container_width=True)
 
     # Create columns for adding and removing names
     st.markdown("<b><small>Ajouter ou retirer des prénoms pour la courbe de popularité</small></b>",
@@ -154,8 +69,11 @@ if not filtered_names.empty:
     col1, col2 = st.columns(2)
 
     with col1:
+        # Only the best matches of the search are sent to the browser
+        name_query = st.text_input(
+            "Rechercher un prénom", key='add_name_query', placeholder="Rechercher un prénom", label_visibility="collapsed")
         name_to_add = st.selectbox(
-            "Ajouter un prénom", aggregated_names['preusuel'].unique(), key='add_name_select', label_visibility="collapsed")
+            "Ajouter un prénom", search_names(name_query), key='add_name_select', label_visibility="collapsed")
         if st.button("Ajouter", key='add_button'):
             add_name()
 
@@ -167,52 +85,37 @@ if not filtered_names.empty:
 
     # Filter data for the selected names and the selected years
     if st.session_state.selected_names:
-        selected_names_data = names[(names['preusuel'].isin(st.session_state.selected_names)) &
-                                    (names['annais'] >= start_year) &
-                                    (names['annais'] <= end_year)]
-
-        # Calculate the rank for each year
-        yearly_counts = filtered_names.groupby(['annais', 'preusuel']).agg({
-            'nombre': 'sum'}).reset_index()
-        yearly_counts['rank'] = yearly_counts.groupby(
-            'annais')['nombre'].rank(method='first', ascending=False)
-
-        # Get the rank for the selected names
-        name_rank_data = yearly_counts[yearly_counts['preusuel'].isin(
-            st.session_state.selected_names)]
-
-        # Create a selection that allows zooming
-        zoom = alt.selection_interval(bind='scales')
-
-        # Create the popularity over time chart
-        popularity_chart = alt.Chart(name_rank_data).mark_line(point=alt.OverlayMarkDef(color='orange'), color='orange').encode(
-            x=alt.X('annais:O', title='Année', axis=alt.Axis(format='d')),
-            y=alt.Y('rank:Q', title='Rang', scale=alt.Scale(
-                domain=(0, name_rank_data['rank'].max() + 1))),
-            color=alt.Color('preusuel:N', title='Prénom'),
-            tooltip=[alt.Tooltip('annais:O', title='annee'),
-                     alt.Tooltip('rank:Q', title='rang')]
-        ).properties(
-            title="Popularité des prénoms au cours des années",
-            width=1000,
-            height=600
-        ).add_selection(zoom)
-
-        popularity_text = popularity_chart.mark_text(
-            align='left',
-            baseline='middle',
-            dx=5, dy=-5,
-            color='white'
-        ).encode(
-            text='rank:Q'
-        )
-
-        popularity_combined_chart = (popularity_chart + popularity_text).properties(
-            title="Popularité des prénoms au cours des années"
-        )
+        # Get the rank of the selected names for each year
+        name_rank_data = rank_series(
+            tuple(st.session_state.selected_names), period)
+
+        # Beyond MAX_LABELLED_NAMES names, only the end of each curve is
+        # labelled
+        name_ends = None
+        if len(st.session_state.selected_names) > MAX_LABELLED_NAMES:
+            name_ends = rank_ends(
+                tuple(st.session_state.selected_names), period)
+        popularity_combined_chart = popularity_chart(name_rank_data, name_ends)
 
         # Display the popularity chart
-        st.altair_chart(popularity_combined_chart.configure_title(
-            fontSize=24, anchor='start'), use_container_width=False)
+        st.altair_chart(popularity_combined_chart, use_container_width=False)
+
+    # Names suddenly popular, declining or steady in the selected years,
+    # from the index of names_trends.py
+    st.markdown("<b><small>Prénoms soudainement populaires, en déclin ou stables</small></b>",
+                unsafe_allow_html=True)
+    trend_labels = {'burst': 'Soudainement populaires',
+                    'decline': 'En déclin', 'steady': 'Stables'}
+    trend_kind = st.radio("Tendance", list(trend_labels), format_func=trend_labels.get,
+                          horizontal=True, label_visibility="collapsed")
+    trending = trending_names(period, trend_kind, 20)
+    if trending.empty:
+        st.write("Aucun prénom pour cette tendance dans la période sélectionnée.")
+    else:
+        st.altair_chart(trend_chart(trending, trend_kind),
+                        use_container_width=False)
+        st.button("Ajouter les 5 premiers à la courbe de popularité",
+                  key='add_trending_button', on_click=add_trending_names,
+                  args=(list(trending['preusuel'][:5]),))
 else:
     st.write("No data available for the selected year range.")